@@ -0,0 +1,176 @@
+import hashlib
+import os
+import sys
+import threading
+import time
+from db import (
+    get_all_artifacts, save_artifact, delete_artifact, replace_artifacts,
+    get_db, get_outbox, get_table, SHARED_DB
+)
+from models import Entry, FeedItem
+from utils import custom_logger, sanitize_filename
+
+DATA_PATH = os.getenv("DATA_PATH", "/data")
+ARTIFACT_KINDS = ("raw", "cleaned", "epub")
+logger = custom_logger(__name__)
+
+
+def artifact_paths(entry_title: str, feed_title: str) -> dict[str, str]:
+    """
+    Returns where each artifact of an entry is stored, by kind.
+    """
+    feed_path = os.path.join(DATA_PATH, sanitize_filename(feed_title))
+    file_name = sanitize_filename(entry_title)
+    return {
+        "raw": os.path.join(feed_path, "html", f"{file_name}.html"),
+        "cleaned": os.path.join(feed_path, "cleaned", f"{file_name}.html"),
+        "epub": os.path.join(feed_path, f"{file_name}.epub"),
+    }
+
+
+def _describe(path: str, data: bytes | None = None) -> dict:
+    if data is None:
+        with open(path, "rb") as f:
+            data = f.read()
+    return {
+        "path": path,
+        "size": len(data),
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "time": int(time.time()),
+    }
+
+
+class ArtifactManifest:
+    """
+    Which files of which entry are on disk, kept in the artifacts table and mirrored
+    in memory. The pipeline asks the manifest instead of probing the data volume,
+    which is slow when it is network mounted. Use reconcile after changing files by hand.
+    With SHARED_DB, the table is read on every lookup instead of mirrored.
+    """
+    def __init__(self):
+        self._records = None
+        self._directories = set()
+        self._lock = threading.Lock()
+        self._checked = False
+
+    def _load(self) -> dict:
+        # Other replicas sharing db.json record artifacts too, so the mirror is read again
+        if self._records is None or SHARED_DB:
+            self._records = {r["link"]: r for r in get_all_artifacts()}
+        return self._records
+
+    def clear(self):
+        with self._lock:
+            self._records = None
+            self._directories.clear()
+
+    def artifact(self, link: str, kind: str) -> dict | None:
+        """
+        Returns the path, size and hash of an artifact of an entry, None if it has none.
+        """
+        with self._lock:
+            return self._load().get(link, {}).get(kind)
+
+    def path(self, link: str, kind: str) -> str | None:
+        artifact = self.artifact(link, kind)
+        return artifact["path"] if artifact else None
+
+    def has(self, link: str, kind: str, path: str) -> bool:
+        """
+        Returns True if the manifest has the artifact of an entry at path. An artifact
+        stored at another path, e.g. under an old feed title, doesn't count.
+        """
+        return self.path(link, kind) == path
+
+    def paths(self, link: str) -> list[str]:
+        with self._lock:
+            record = self._load().get(link, {})
+        return [record[kind]["path"] for kind in ARTIFACT_KINDS if kind in record]
+
+    def record(self, entry: Entry, feed: FeedItem, kind: str, path: str, data: bytes | None = None):
+        """
+        Records that an artifact of an entry was written to path. Pass the written
+        data when at hand, otherwise the file is read back to hash it.
+        """
+        artifact = _describe(path, data)
+        with self._lock:
+            records = self._load()
+            record = records.get(entry.link) or {"link": entry.link}
+            record = {**record, "title": entry.title, "feed": feed.title, kind: artifact}
+            records[entry.link] = record
+            save_artifact(record)
+
+    def forget(self, link: str):
+        with self._lock:
+            if self._load().pop(link, None) is not None:
+                delete_artifact(link)
+
+    def ensure_directory(self, path: str):
+        """
+        Creates a directory once per process, instead of a makedirs call per entry.
+        """
+        if path not in self._directories:
+            os.makedirs(path, exist_ok=True)
+            self._directories.add(path)
+
+    def reconcile_if_empty(self) -> dict | None:
+        """
+        Rebuilds the manifest from disk if the artifacts table is empty, as after upgrading
+        from a version without it. Checked once per process. Returns the reconcile counts.
+        """
+        if self._checked:
+            return None
+        self._checked = True
+        with self._lock:
+            if self._load():
+                return None
+        logger.info("Artifact manifest is empty, recording the files already in DATA_PATH")
+        return self.reconcile()
+
+    def reconcile(self) -> dict:
+        """
+        Rebuilds the manifest from the files on disk. Files are matched to entries by the
+        titles of the entries the database knows about; files that match no entry are
+        only counted. Returns counts of the recorded, dropped and unmatched files.
+        """
+        known = {}
+        entries = [(entry, entry.get("feed", {})) for entry in get_db().all()]
+        entries += [(r["batch"]["entry"], r["batch"]["feed"]) for r in get_outbox()]
+        entries += [(r, r.get("feed", {})) for r in get_table('digest').all()]
+        entries += [(r["entry"], r["feed"]) for r in get_table('patreon_rechecks').all()]
+        for entry, feed in entries:
+            for kind, path in artifact_paths(entry["title"], feed.get("title", "")).items():
+                known[path] = (entry, feed, kind)
+
+        with self._lock:
+            previous = self._load()
+            records, matched, unmatched = {}, set(), 0
+            for directory, _, files in os.walk(DATA_PATH):
+                for name in files:
+                    path = os.path.join(directory, name)
+                    if path not in known:
+                        if name.endswith((".html", ".epub")):
+                            unmatched += 1
+                        continue
+                    entry, feed, kind = known[path]
+                    record = records.setdefault(entry["link"], {"link": entry["link"], "title": entry["title"], "feed": feed.get("title", "")})
+                    record[kind] = _describe(path)
+                    matched.add(path)
+            dropped = sum(
+                1 for record in previous.values() for kind in ARTIFACT_KINDS
+                if kind in record and record[kind]["path"] not in matched
+            )
+            replace_artifacts(list(records.values()))
+            self._records = records
+        logger.info(f"Reconciled artifact manifest: {len(matched)} files recorded, {dropped} dropped, {unmatched} unmatched")
+        return {"recorded": len(matched), "dropped": dropped, "unmatched": unmatched}
+
+
+MANIFEST = ArtifactManifest()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["reconcile"]:
+        print("usage: python artifacts.py reconcile")
+        sys.exit(2)
+    print(MANIFEST.reconcile())
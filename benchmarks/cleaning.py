@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Cleaning engine benchmark.
+
+Cleans the recorded chapter fixtures with the BeautifulSoup cleaners and with the lxml
+site rules, reports the time per chapter of each engine and fails if their output
+differs in text, or in markup when COMPACT_OUTPUT is on.
+
+    python benchmarks/cleaning.py
+    python benchmarks/cleaning.py --iterations 500
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from string import Template
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+FIXTURES_DIR = os.path.join(BENCH_DIR, "fixtures")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def load_chapter(name: str) -> str:
+    with open(os.path.join(FIXTURES_DIR, name), "r") as f:
+        return Template(f.read()).substitute(title="Chapter 1", heading="Chapter 1")
+
+
+def normalize(html: str) -> str:
+    return WHITESPACE_PATTERN.sub(" ", html).strip()
+
+
+def text_of(html: str) -> str:
+    import lxml.html
+    return normalize(lxml.html.fragment_fromstring(html, create_parent="div").text_content()) if html else ""
+
+
+def measure(clean, html: str, iterations: int) -> tuple[float, str]:
+    output = clean(html)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        clean(html)
+    return (time.perf_counter() - start) / iterations, output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cleaning engine benchmark")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    os.chdir(REPO_DIR)
+    import logging
+    import feeder
+    from site_rules import SITE_RULES, clean_page
+
+    logging.disable(logging.WARNING)
+    keywords = feeder.load_keywords()
+    cases = {
+        "royalroad": (
+            load_chapter("royalroad_chapter.html"),
+            lambda html: feeder.clean_royal_road(html, keywords),
+        ),
+        "wanderinginn": (
+            load_chapter("wanderinginn_chapter.html"),
+            lambda html: feeder.clean_wandering_inn(html, ""),
+        ),
+    }
+
+    failures = []
+    print(f"{'site':<14}{'soup':>10}{'rules':>10}{'speedup':>9}")
+    for site, (html, clean_soup) in cases.items():
+        rule = SITE_RULES[site]
+        soup_seconds, soup_output = measure(clean_soup, html, args.iterations)
+        rules_seconds, rules_output = measure(
+            lambda page: clean_page(page, rule, keywords=keywords, compact=feeder.COMPACT_OUTPUT),
+            html,
+            args.iterations,
+        )
+        print(
+            f"{site:<14}{soup_seconds * 1000:>8.2f}ms{rules_seconds * 1000:>8.2f}ms"
+            f"{soup_seconds / rules_seconds:>8.1f}x"
+        )
+        if text_of(soup_output) != text_of(rules_output):
+            failures.append(f"{site}: the engines extract different text")
+        # Without COMPACT_OUTPUT the soup cleaners prettify, only the text is comparable
+        elif feeder.COMPACT_OUTPUT and normalize(soup_output) != normalize(rules_output):
+            failures.append(f"{site}: the engines produce different markup")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
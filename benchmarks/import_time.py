@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Import-time budget check for the web app and the feeder.
+
+Imports each module in a fresh interpreter, fails if the import takes longer than the
+budget or if it pulled in a scraping/conversion library that should only load on first use.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --budget 0.5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ["main", "feeder", "db"]
+LAZY_MODULES = ["requests_html", "pyppeteer", "pypandoc", "bs4", "feedparser", "ebooklib", "uvicorn"]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "modules": sorted(sys.modules)}}))
+"""
+
+
+def measure(module: str, config_path: str) -> dict:
+    env = dict(os.environ, CONFIG_PATH=config_path)
+    output = subprocess.check_output(
+        [sys.executable, "-c", PROBE.format(module=module)],
+        cwd=REPO_DIR,
+        env=env,
+    )
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time budget check")
+    parser.add_argument("--budget", type=float, default=1.0, help="Seconds allowed per module import")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as config_path:
+        for module in MODULES:
+            runs = [measure(module, config_path) for _ in range(args.repeat)]
+            seconds = min(run["seconds"] for run in runs)
+            loaded = [name for name in LAZY_MODULES if name in runs[0]["modules"]]
+            print(f"{module:<8}{seconds * 1000:>8.1f}ms  eager heavy imports: {', '.join(loaded) or 'none'}")
+            if seconds > args.budget:
+                failures.append(f"{module} took {seconds:.3f}s (budget {args.budget:.3f}s)")
+            if loaded:
+                failures.append(f"{module} imports {', '.join(loaded)} at import time")
+        # Importing must not open the database, that happens in the startup hook
+        if os.listdir(config_path):
+            failures.append(f"Importing created {', '.join(os.listdir(config_path))} in CONFIG_PATH")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the feeder pipeline.
+
+Serves the recorded fixtures from a local HTTP stand-in, receives mail on a local
+SMTP sink and runs full feeder cycles for N feeds x M chapters. Reports end-to-end
+cycle time and per-stage throughput, and compares them with benchmarks/baseline.json.
+
+    python benchmarks/run.py --feeds 4 --chapters 5
+    python benchmarks/run.py --update-baseline
+"""
+import argparse
+import json
+import os
+import shutil
+import socketserver
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from string import Template
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+FIXTURES_DIR = os.path.join(BENCH_DIR, "fixtures")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+
+def load_fixture(name: str) -> Template:
+    with open(os.path.join(FIXTURES_DIR, name), "r") as f:
+        return Template(f.read())
+
+
+class FixtureSite:
+    """
+    Generates the pages of N Royal Road and Wandering Inn style feeds with M chapters each.
+    Even feed ids are Royal Road fictions, odd ones are Wandering Inn style WordPress feeds.
+    """
+    def __init__(self, base: str, feeds: int, chapters: int):
+        self.base = base
+        self.feeds = feeds
+        self.chapters = chapters
+        self.feed_template = load_fixture("feed.xml")
+        self.item_template = load_fixture("feed_item.xml")
+        self.royalroad_chapter = load_fixture("royalroad_chapter.html")
+        self.wanderinginn_chapter = load_fixture("wanderinginn_chapter.html")
+        self.toc_template = load_fixture("royalroad_toc.html")
+        self.toc_row_template = load_fixture("royalroad_toc_row.html")
+
+    def feed_urls(self) -> list[str]:
+        urls = []
+        for feed_id in range(self.feeds):
+            if feed_id % 2 == 0:
+                urls.append(f"{self.base}/royalroad.com/fiction/syndication/{feed_id}")
+            else:
+                urls.append(f"{self.base}/wanderinginn/{feed_id}/feed/")
+        return urls
+
+    def chapter_path(self, feed_id: int, chapter: int) -> str:
+        if feed_id % 2 == 0:
+            return f"/fiction/{feed_id}/bench-story-{feed_id}/chapter/{chapter}"
+        return f"/wanderinginn/{feed_id}/chapter-{chapter}/"
+
+    def chapter_url(self, feed_id: int, chapter: int) -> str:
+        prefix = "/royalroad.com" if feed_id % 2 == 0 else ""
+        return self.base + prefix + self.chapter_path(feed_id, chapter)
+
+    def render_feed(self, feed_id: int) -> str:
+        items = []
+        # Feeds list the newest chapter first
+        for chapter in range(self.chapters, 0, -1):
+            items.append(self.item_template.substitute(
+                title=f"Chapter {chapter}",
+                link=self.chapter_url(feed_id, chapter),
+                date=formatdate(1746446400 + chapter * 3600, usegmt=True),
+            ))
+        return self.feed_template.substitute(
+            title=f"Bench Story {feed_id}",
+            link=self.base,
+            items="\n".join(items),
+        )
+
+    def render_toc(self, feed_id: int) -> str:
+        rows = [
+            self.toc_row_template.substitute(href=self.chapter_path(feed_id, chapter), title=f"Chapter {chapter}")
+            for chapter in range(1, self.chapters + 1)
+        ]
+        return self.toc_template.substitute(title=f"Bench Story {feed_id}", rows="".join(rows))
+
+    def resolve(self, path: str):
+        """
+        Returns (content type, body) for a request path, or None when not found.
+        """
+        parts = [part for part in path.split("/") if part]
+        if parts[:3] == ["royalroad.com", "fiction", "syndication"]:
+            return "application/rss+xml", self.render_feed(int(parts[3]))
+        if parts[:2] == ["royalroad.com", "fiction"] and len(parts) == 3:
+            return "text/html", self.render_toc(int(parts[2]))
+        if parts[:2] == ["royalroad.com", "fiction"] and "chapter" in parts:
+            return "text/html", self.royalroad_chapter.substitute(
+                title=f"Chapter {parts[-1]}", heading=f"Bench Story {parts[2]}, Chapter {parts[-1]}"
+            )
+        if parts[:1] == ["wanderinginn"] and parts[-1] == "feed":
+            return "application/rss+xml", self.render_feed(int(parts[1]))
+        if parts[:1] == ["wanderinginn"] and len(parts) == 3:
+            return "text/html", self.wanderinginn_chapter.substitute(
+                title=parts[2], heading=f"Bench Story {parts[1]}, {parts[2]}"
+            )
+        return None
+
+
+def start_http_stand_in(site_factory):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            resolved = server.site.resolve(self.path)
+            if resolved is None:
+                self.send_error(404)
+                return
+            content_type, body = resolved
+            payload = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.site = site_factory(f"http://127.0.0.1:{server.server_address[1]}")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """
+    A minimal SMTP server that accepts any login and discards messages, counting them.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes_received = 0
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), SMTPSinkHandler)
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, line: str):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        self.reply("220 localhost benchmark sink")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("ascii", "replace").strip().upper()
+            if command.startswith("EHLO"):
+                self.reply("250-localhost")
+                self.reply("250 AUTH PLAIN LOGIN")
+            elif command.startswith("HELO"):
+                self.reply("250 localhost")
+            elif command.startswith("AUTH"):
+                self.reply("235 Authentication successful")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                for data_line in self.rfile:
+                    if data_line in (b".\r\n", b".\n"):
+                        break
+                    size += len(data_line)
+                with self.server.lock:
+                    self.server.messages += 1
+                    self.server.bytes_received += size
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+def configure_environment(http_base: str, smtp_port: int, chapters: int, work_dir: str):
+    """
+    Points the pipeline at the stand-ins. Must run before the repo modules are imported.
+    """
+    os.environ.update({
+        "DATA_PATH": os.path.join(work_dir, "data"),
+        "CONFIG_PATH": os.path.join(work_dir, "config"),
+        "ROYAL_ROAD_BASE_URL": f"{http_base}/royalroad.com",
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": str(smtp_port),
+        "SMTP_SSL": "false",
+        "SENDER_EMAIL": "bench@localhost",
+        "APP_PASSWORD": "bench",
+        "TO_EMAIL": "kindle@localhost",
+        "DEBUG_MODE": "false",
+        "MAX_BATCH_SIZE": "1000000",
+        "ENTRY_THRESHOLD_FOR_NEW_BOOK": os.environ.get("ENTRY_THRESHOLD_FOR_NEW_BOOK", str(chapters + 1)),
+    })
+
+
+def reset_state(work_dir: str):
+    import artifacts
+    import db
+    db.get_db().truncate()
+    db.get_db().drop_table("outbox")
+    db.get_db().drop_table("artifacts")
+    db.get_db().drop_table("toc_snapshots")
+    artifacts.MANIFEST.clear()
+    shutil.rmtree(os.path.join(work_dir, "data"), ignore_errors=True)
+
+
+def run_benchmark(feeds: int, chapters: int, repeat: int) -> dict:
+    work_dir = tempfile.mkdtemp(prefix="webtoepub-bench-")
+    http_server = start_http_stand_in(lambda base: FixtureSite(base, feeds, chapters))
+    smtp_server = SMTPSink()
+    threading.Thread(target=smtp_server.serve_forever, daemon=True).start()
+    http_base = f"http://127.0.0.1:{http_server.server_address[1]}"
+    configure_environment(http_base, smtp_server.server_address[1], chapters, work_dir)
+
+    # feeder reads keywords.txt and epub.css relative to the working directory
+    os.chdir(REPO_DIR)
+    sys.path.insert(0, REPO_DIR)
+    import logging
+    import db
+    import feeder
+    from metrics import STAGE_SECONDS
+    from models import FeedItem
+    logging.disable(logging.INFO)
+
+    for i, url in enumerate(http_server.site.feed_urls()):
+        db.add_feed(FeedItem(name=f"Bench Story {i}", url=url))
+
+    cold_cycles, warm_cycles, stage_runs = [], [], []
+    try:
+        for _ in range(repeat):
+            reset_state(work_dir)
+            STAGE_SECONDS.reset()
+            sent_before = smtp_server.messages
+            start = time.perf_counter()
+            feeder.execute()
+            cold_cycles.append(time.perf_counter() - start)
+            stage_runs.append(STAGE_SECONDS.totals("stage"))
+            delivered = smtp_server.messages - sent_before
+            if delivered != feeds * chapters and int(os.environ["ENTRY_THRESHOLD_FOR_NEW_BOOK"]) > chapters:
+                raise RuntimeError(f"Expected {feeds * chapters} emails, sink received {delivered}")
+
+            # A second cycle with nothing new measures the steady-state polling cost
+            start = time.perf_counter()
+            feeder.execute()
+            warm_cycles.append(time.perf_counter() - start)
+    finally:
+        http_server.shutdown()
+        smtp_server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    stages = {}
+    for stage in sorted({stage for run in stage_runs for stage in run} - {"cycle"}):
+        per_item = [run[stage][1] / run[stage][0] for run in stage_runs if stage in run and run[stage][0]]
+        count = max(run.get(stage, (0, 0))[0] for run in stage_runs)
+        stages[stage] = {
+            "count": count,
+            "seconds_per_item": statistics.median(per_item),
+            "items_per_second": 1 / statistics.median(per_item) if statistics.median(per_item) else 0,
+        }
+
+    return {
+        "feeds": feeds,
+        "chapters": chapters,
+        "repeat": repeat,
+        "cold_cycle_seconds": statistics.median(cold_cycles),
+        "warm_cycle_seconds": statistics.median(warm_cycles),
+        "emails_per_cycle": feeds * chapters,
+        "stages": stages,
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Returns a description of every measurement that is slower than the baseline allows.
+    """
+    regressions = []
+    if (result["feeds"], result["chapters"]) != (baseline["feeds"], baseline["chapters"]):
+        print(f"Note: baseline was recorded for {baseline['feeds']} feeds x {baseline['chapters']} chapters")
+    for key in ("cold_cycle_seconds", "warm_cycle_seconds"):
+        if result[key] > baseline[key] * (1 + tolerance):
+            regressions.append(f"{key}: {result[key]:.3f}s vs baseline {baseline[key]:.3f}s")
+    for stage, stats in result["stages"].items():
+        previous = baseline["stages"].get(stage)
+        if previous and stats["seconds_per_item"] > previous["seconds_per_item"] * (1 + tolerance):
+            regressions.append(
+                f"{stage}: {stats['seconds_per_item'] * 1000:.1f}ms/item "
+                f"vs baseline {previous['seconds_per_item'] * 1000:.1f}ms/item"
+            )
+    return regressions
+
+
+def print_report(result: dict):
+    print(f"{result['feeds']} feeds x {result['chapters']} chapters, median of {result['repeat']} run(s)")
+    print(f"  cold cycle: {result['cold_cycle_seconds']:.3f}s")
+    print(f"  warm cycle: {result['warm_cycle_seconds']:.3f}s")
+    print(f"  {'stage':<18}{'count':>7}{'ms/item':>12}{'items/s':>12}")
+    for stage, stats in result["stages"].items():
+        print(f"  {stage:<18}{stats['count']:>7}{stats['seconds_per_item'] * 1000:>12.2f}{stats['items_per_second']:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the feeder pipeline")
+    parser.add_argument("--feeds", type=int, default=4)
+    parser.add_argument("--chapters", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown before reporting a regression")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.feeds, args.chapters, args.repeat)
+    print_report(result)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(result, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline found, run with --update-baseline to record one")
+        return 0
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+    regressions = compare(result, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
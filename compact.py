@@ -0,0 +1,157 @@
+import re
+
+# Elements that never carry chapter text
+DROP_TAGS = ["script", "style", "noscript", "iframe", "form", "button", "input", "svg", "link", "meta"]
+# Inline wrappers that only carry styling, replaced by their children once their attributes are gone
+UNWRAP_TAGS = ["span", "font"]
+# Elements removed when they contain no text and no images
+EMPTY_TAGS = ["p", "div", "span", "em", "strong", "b", "i", "u", "font", "a", "section", "blockquote"]
+KEEP_ATTRIBUTES = {"href", "src", "alt", "colspan", "rowspan", "dir", "lang"}
+# Inline style declarations that change how the text reads, everything else is dropped
+KEEP_STYLES = {"text-align", "font-weight", "font-style", "text-decoration"}
+PRESERVE_WHITESPACE_TAGS = {"pre", "code", "textarea"}
+BLOCK_TAGS = {
+    "p", "div", "section", "article", "blockquote", "ul", "ol", "li", "table", "thead", "tbody",
+    "tr", "td", "th", "h1", "h2", "h3", "h4", "h5", "h6", "hr", "br", "figure", "figcaption", "pre",
+}
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def _filter_style(style: str) -> str:
+    declarations = []
+    for declaration in style.split(";"):
+        name, _, value = declaration.partition(":")
+        name = name.strip().lower()
+        if name in KEEP_STYLES and value.strip():
+            declarations.append(f"{name}:{value.strip()}")
+    return ";".join(declarations)
+
+
+def _is_block_boundary(node) -> bool:
+    return node is None or getattr(node, "name", None) in BLOCK_TAGS
+
+
+def compact_html(element) -> str:
+    """
+    Serializes a BeautifulSoup element as minified markup for the EPUB.
+    Drops scripts, comments, tracking and styling attributes, decorative wrappers
+    and empty elements, and collapses whitespace instead of prettifying.
+    """
+    from bs4 import Comment, NavigableString
+
+    for text in element.find_all(string=True):
+        if isinstance(text, Comment):
+            text.extract()
+    for tag in element.find_all(DROP_TAGS):
+        tag.decompose()
+
+    for tag in [element] + element.find_all(True):
+        attributes = {}
+        for name, value in tag.attrs.items():
+            if name in KEEP_ATTRIBUTES:
+                attributes[name] = value
+            elif name == "style":
+                style = _filter_style(value)
+                if style:
+                    attributes["style"] = style
+        tag.attrs = attributes
+
+    for tag in element.find_all(UNWRAP_TAGS):
+        if not tag.attrs:
+            tag.unwrap()
+
+    # Deepest elements first so parents left empty by their children are removed too
+    for tag in reversed(element.find_all(EMPTY_TAGS)):
+        if not tag.get_text(strip=True) and not tag.find(["img", "br", "hr"]):
+            tag.decompose()
+
+    # Merge the text nodes left next to each other by the removals above
+    element.smooth()
+    for text in element.find_all(string=True):
+        if not isinstance(text, NavigableString) or any(parent.name in PRESERVE_WHITESPACE_TAGS for parent in text.parents):
+            continue
+        collapsed = WHITESPACE_PATTERN.sub(" ", text)
+        # Whitespace at the edges of a block element is not rendered
+        if text.previous_sibling is None and text.parent.name in BLOCK_TAGS:
+            collapsed = collapsed.lstrip()
+        if text.next_sibling is None and text.parent.name in BLOCK_TAGS:
+            collapsed = collapsed.rstrip()
+        if collapsed.strip() == "" and _is_block_boundary(text.previous_sibling) and _is_block_boundary(text.next_sibling):
+            text.extract()
+        elif collapsed != text:
+            text.replace_with(collapsed)
+
+    return element.decode(formatter="minimal")
+
+
+def _preserves_whitespace(tag) -> bool:
+    return tag.tag in PRESERVE_WHITESPACE_TAGS or any(
+        parent.tag in PRESERVE_WHITESPACE_TAGS for parent in tag.iterancestors()
+    )
+
+
+def _compact_text(text: str, parent_tag: str, first: bool, last: bool) -> str:
+    collapsed = WHITESPACE_PATTERN.sub(" ", text)
+    if first and parent_tag in BLOCK_TAGS:
+        collapsed = collapsed.lstrip()
+    if last and parent_tag in BLOCK_TAGS:
+        collapsed = collapsed.rstrip()
+    return collapsed
+
+
+def compact_tree(element) -> str:
+    """
+    compact_html for an lxml.html element, applying the same rules to the tree
+    directly instead of going through BeautifulSoup.
+    """
+    import lxml.html
+
+    for node in element.xpath(".//comment() | .//processing-instruction()"):
+        node.drop_tree()
+    for tag in list(element.iterdescendants(*DROP_TAGS)):
+        tag.drop_tree()
+
+    for tag in element.iter():
+        attributes = {}
+        for name, value in tag.attrib.items():
+            if name in KEEP_ATTRIBUTES:
+                attributes[name] = value
+            elif name == "style":
+                style = _filter_style(value)
+                if style:
+                    attributes["style"] = style
+        tag.attrib.clear()
+        tag.attrib.update(attributes)
+
+    for tag in list(element.iterdescendants(*UNWRAP_TAGS)):
+        if not tag.attrib:
+            tag.drop_tag()
+
+    # Deepest elements first so parents left empty by their children are removed too
+    for tag in reversed(list(element.iterdescendants(*EMPTY_TAGS))):
+        if not tag.text_content().strip() and next(tag.iter("img", "br", "hr"), None) is None:
+            tag.drop_tree()
+
+    # lxml keeps text as .text (before the first child) and .tail (after an element),
+    # so neighbouring text is always merged already
+    for tag in element.iter():
+        if _preserves_whitespace(tag):
+            continue
+        children = list(tag)
+        if tag.text:
+            collapsed = _compact_text(tag.text, tag.tag, True, not children)
+            if collapsed.strip() == "" and (not children or children[0].tag in BLOCK_TAGS):
+                tag.text = None
+            else:
+                tag.text = collapsed
+        for i, child in enumerate(children):
+            if not child.tail:
+                continue
+            following = children[i + 1] if i + 1 < len(children) else None
+            collapsed = _compact_text(child.tail, tag.tag, False, following is None)
+            if collapsed.strip() == "" and child.tag in BLOCK_TAGS and (following is None or following.tag in BLOCK_TAGS):
+                child.tail = None
+            else:
+                child.tail = collapsed
+
+    return lxml.html.tostring(element, encoding="unicode", with_tail=False)
@@ -0,0 +1,233 @@
+import atexit
+import base64
+import json
+import os
+import queue
+import re
+import socket
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from utils import custom_logger
+
+PANDOC_WORKERS = int(os.getenv("PANDOC_WORKERS", min(4, os.cpu_count() or 1)))
+PANDOC_JOB_TIMEOUT_SECONDS = int(os.getenv("PANDOC_JOB_TIMEOUT_SECONDS", "120"))
+PANDOC_WORKER_MAX_RSS_MB = int(os.getenv("PANDOC_WORKER_MAX_RSS_MB", "512"))
+PANDOC_WORKER_START_TIMEOUT_SECONDS = 10
+EPUB_CSS_PATH = "./epub.css"
+SRC_PATTERN = re.compile(r'src="([^"]+)"')
+logger = custom_logger(__name__)
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class PandocWorker:
+    """
+    A long-lived `pandoc server` process that converts documents over HTTP,
+    saving the process spawn and runtime start-up of a pandoc call per chapter.
+    """
+    def __init__(self, pandoc_path: str, timeout: int):
+        self.pandoc_path = pandoc_path
+        self.timeout = timeout
+        self.process = None
+        self.port = None
+
+    def start(self):
+        self.port = _free_port()
+        self.process = subprocess.Popen(
+            [self.pandoc_path, "server", "--port", str(self.port), "--timeout", str(self.timeout)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + PANDOC_WORKER_START_TIMEOUT_SECONDS
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"pandoc server exited with code {self.process.returncode}")
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=1):
+                    return
+            except OSError:
+                time.sleep(0.05)
+        self.stop()
+        raise RuntimeError("pandoc server did not start in time")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def memory_mb(self) -> float | None:
+        """
+        Returns the resident memory of the server process, or None where /proc isn't available.
+        """
+        try:
+            with open(f"/proc/{self.process.pid}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) / 1024
+        except (OSError, AttributeError):
+            return None
+        return None
+
+    def convert(self, request: dict) -> bytes:
+        if not self.alive():
+            self.start()
+        http_request = urllib.request.Request(
+            f"http://127.0.0.1:{self.port}/",
+            data=json.dumps(request).encode("utf-8"),
+            headers={"Content-Type": "application/json", "Accept": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(http_request, timeout=self.timeout + 5) as response:
+                result = json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            # The document was rejected, the worker itself is fine
+            raise ValueError(f"pandoc server rejected the job: {e.read().decode('utf-8', 'replace')}")
+        output = result["output"]
+        return base64.b64decode(output) if result.get("base64") else output.encode("utf-8")
+
+
+class PandocPool:
+    """
+    A fixed set of pandoc workers. Each job borrows an idle worker, so up to size
+    conversions run in parallel. Workers that fail or time out on a job, or grow past
+    max_rss_mb, are stopped and restarted on their next job.
+    """
+    def __init__(self, pandoc_path: str, size: int, timeout: int, max_rss_mb: int):
+        self.max_rss_mb = max_rss_mb
+        self.workers = [PandocWorker(pandoc_path, timeout) for _ in range(size)]
+        self._idle = queue.Queue()
+        try:
+            for worker in self.workers:
+                worker.start()
+                self._idle.put(worker)
+        except Exception:
+            # The pool is dropped, so nothing else would stop the servers started so far
+            self.shutdown()
+            raise
+
+    def convert(self, request: dict) -> bytes:
+        worker = self._idle.get()
+        try:
+            return worker.convert(request)
+        except ValueError:
+            raise
+        except Exception:
+            logger.warning(f"Recycling pandoc worker on port {worker.port} after a failed job")
+            worker.stop()
+            raise
+        finally:
+            memory = worker.memory_mb() if worker.alive() else None
+            if memory is not None and memory > self.max_rss_mb:
+                logger.info(f"Recycling pandoc worker on port {worker.port} using {memory:.0f}MB")
+                worker.stop()
+            self._idle.put(worker)
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.stop()
+
+
+_pool = None
+_pool_failed = False
+_pool_lock = threading.Lock()
+
+
+def get_pandoc_pool() -> PandocPool | None:
+    """
+    Returns the shared worker pool, starting it on first use.
+    Returns None when PANDOC_WORKERS is 0 or the workers can't be started,
+    in which case callers convert with a pandoc process per document.
+    """
+    global _pool, _pool_failed
+    if PANDOC_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None and not _pool_failed:
+            import pypandoc
+            try:
+                _pool = PandocPool(
+                    pypandoc.get_pandoc_path(),
+                    PANDOC_WORKERS,
+                    PANDOC_JOB_TIMEOUT_SECONDS,
+                    PANDOC_WORKER_MAX_RSS_MB
+                )
+                atexit.register(_pool.shutdown)
+                logger.info(f"Started {PANDOC_WORKERS} pandoc server workers")
+            except Exception as e:
+                logger.exception(f"Could not start pandoc server workers, converting per process: {e}")
+                _pool_failed = True
+        return _pool
+
+
+def _meta_string(value: str) -> dict:
+    return {"t": "MetaString", "c": value}
+
+
+def _local_resources(text: str) -> dict:
+    """
+    Returns {path: base64 contents} for the local files a document references, such as
+    embedded images, since the pandoc server can't read from disk itself.
+    """
+    resources = {}
+    for path in set(SRC_PATTERN.findall(text)):
+        if os.path.isabs(path) and os.path.isfile(path):
+            with open(path, "rb") as f:
+                resources[path] = base64.b64encode(f.read()).decode("ascii")
+    return resources
+
+
+def convert_html_to_epub(html_path: str, output_path: str, title: str, toc_depth: int | None = None):
+    """
+    Converts an HTML file to an EPUB titled title, styled with epub.css.
+    Uses the pandoc worker pool when available, otherwise runs pandoc directly.
+    """
+    pool = get_pandoc_pool()
+    if pool is None:
+        import pypandoc
+        extra_args = [
+            '--metadata', f'title={title}',
+            '--metadata', 'lang=en-US',
+            '--css', EPUB_CSS_PATH,
+            '--wrap=none',
+        ]
+        if toc_depth is not None:
+            extra_args.append(f'--toc-depth={toc_depth}')
+        extra_args.append('--epub-title-page=false')
+        pypandoc.convert_file(html_path, 'epub', outputfile=output_path, extra_args=extra_args)
+        return
+
+    with open(html_path, "r") as f:
+        text = f.read()
+    with open(EPUB_CSS_PATH, "rb") as f:
+        css = base64.b64encode(f.read()).decode("ascii")
+    request = {
+        "text": text,
+        "from": "html",
+        "to": "epub",
+        "standalone": True,
+        "metadata": {
+            "title": _meta_string(title),
+            "lang": _meta_string("en-US"),
+            "date": _meta_string(time.strftime("%Y-%m-%d")),
+        },
+        "css": ["epub.css"],
+        "files": {"epub.css": css, **_local_resources(text)},
+        "epub-title-page": False,
+        "wrap": "none",
+    }
+    if toc_depth is not None:
+        request["toc-depth"] = toc_depth
+    output = pool.convert(request)
+    with open(output_path, "wb") as f:
+        f.write(output)
@@ -1,86 +1,239 @@
 import os
 import time
 import json
-from models import Entry, FeedItem
+import fcntl
+import threading
+from functools import wraps
+from models import EmailBatch, Entry, FeedItem, Subscriber
 from tinydb import TinyDB, Query
+from tinydb.middlewares import Middleware
+from tinydb.storages import JSONStorage
+from tinydb.table import Table
+from metrics import timed_db
+from leases import LEASE_BACKEND
 
 CONFIG_PATH = os.getenv("CONFIG_PATH", "/config")
+# With a shared lease backend, replicas share db.json and lock it across processes
+SHARED_DB = LEASE_BACKEND != "local"
 
-if not os.path.exists(CONFIG_PATH):
-    os.makedirs(CONFIG_PATH)
+db = None
+feeds_table = None
+_init_lock = threading.Lock()
 
-db = TinyDB(os.path.join(CONFIG_PATH, 'db.json'))
-feeds_table = db.table('feeds')
 
+class SharedTable(Table):
+    """
+    A table of a db.json that other replicas write too. Its query cache and next
+    document id are dropped whenever the file lock is taken again.
+    """
+    instances = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        SharedTable.instances.append(self)
+
+    def forget(self):
+        self.clear_cache()
+        self._next_id = None
+
+
+class DatabaseLock:
+    """
+    A reentrant lock around the database file. For SHARED_DB, the outermost acquire
+    also takes an exclusive flock on db.json.lock, so replicas take turns as well.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0 and SHARED_DB:
+            try:
+                if self._file is None:
+                    os.makedirs(CONFIG_PATH, exist_ok=True)
+                    self._file = open(os.path.join(CONFIG_PATH, 'db.json.lock'), 'a')
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+                for table in SharedTable.instances:
+                    table.forget()
+            except BaseException:
+                self._lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        try:
+            if self._depth == 0 and self._file is not None:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+        finally:
+            self._lock.release()
+
+
+# Every access to the database file, see synchronized
+_db_lock = DatabaseLock()
+
+
+class LockingStorage(Middleware):
+    """
+    Serializes reads and writes of the storage. JSONStorage seeks, writes and truncates
+    one shared file handle, so concurrent calls from two threads corrupt the file.
+    """
+    def read(self):
+        with _db_lock:
+            return self.storage.read()
+
+    def write(self, data):
+        with _db_lock:
+            self.storage.write(data)
+
+
+def synchronized(func):
+    """
+    Decorator running a database function under the database lock, so its reads and
+    writes happen as one step for the pipeline, the recheck scheduler, the API threads
+    and, with SHARED_DB, the other replicas.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with _db_lock:
+            return func(*args, **kwargs)
+    return wrapper
+
+def init_db() -> TinyDB:
+    """
+    Opens the database file. Called from the app startup hook, and lazily on first
+    use so importing this module doesn't touch the config volume.
+    """
+    global db, feeds_table
+    with _init_lock:
+        if db is None:
+            if not os.path.exists(CONFIG_PATH):
+                os.makedirs(CONFIG_PATH)
+            db = TinyDB(os.path.join(CONFIG_PATH, 'db.json'), storage=LockingStorage(JSONStorage))
+            if SHARED_DB:
+                db.table_class = SharedTable
+            feeds_table = db.table('feeds')
+    return db
+
+def get_db() -> TinyDB:
+    return db if db is not None else init_db()
+
+def get_feeds_table():
+    get_db()
+    return feeds_table
+
+def get_table(name: str):
+    return get_db().table(name)
+
+@timed_db
+@synchronized
 def add_entry(entry: Entry, feed: FeedItem):
     """
     Adds an entry to the database.
     """
     entry_dict = entry.dict()
     entry_dict["feed"] = feed.dict()
-    db.insert(entry_dict)
+    get_db().insert(entry_dict)
 
+@timed_db
+@synchronized
 def has_entry(entry: Entry) -> bool:
     """
     Checks if an entry exists in the database.
     """
     Entry = Query()
     current_time = int(time.time())
-    response = db.contains(
+    response = get_db().contains(
         (Entry.link == entry.link) & 
         ((Entry.time_sent != 0) | 
          ((Entry.time_sent == 0) & (Entry.patreon_lock > current_time)))
     )
     return response
 
+@timed_db
+@synchronized
 def get_entries() -> list[Entry]:
     """
     Gets all entries from the database sorted by entry.time_sent in descending order.
     """
-    entries = db.all()
+    entries = get_db().all()
     return [Entry(**entry) for entry in sorted(entries, key=lambda x: x["time_sent"], reverse=True)]
 
+@timed_db
+@synchronized
 def delete_entry(link: str) -> bool:
     """
     Deletes an entry from the database by link.
     Returns True if entry was deleted, False otherwise.
     """
     Entry = Query()
-    result = db.remove(Entry.link == link)
+    result = get_db().remove(Entry.link == link)
+    if result:
+        forget_toc_sent(link)
     return len(result) > 0
 
+@timed_db
+@synchronized
+def get_sent_links(links: list[str]) -> tuple[set[str], set[str]]:
+    """
+    Returns which of links belong to sent entries and which to entries that are still
+    patreon-locked, in one pass over the table.
+    """
+    wanted = set(links)
+    current_time = int(time.time())
+    sent, locked = set(), set()
+    for record in get_db().all():
+        if record.get("link") not in wanted:
+            continue
+        if record.get("time_sent"):
+            sent.add(record["link"])
+        elif (record.get("patreon_lock") or 0) > current_time:
+            locked.add(record["link"])
+    return sent, locked
+
 
 # ============== Feed Management Functions ==============
 
+@timed_db
+@synchronized
 def get_all_feeds() -> list[FeedItem]:
     """
     Gets all feeds from the feeds table.
     """
-    records = feeds_table.all()
+    records = get_feeds_table().all()
     return [FeedItem(**r) for r in records]
 
 
+@timed_db
+@synchronized
 def get_feed_by_url(url: str) -> FeedItem | None:
     """
     Gets a single feed by its URL.
     """
     q = Query()
-    record = feeds_table.get(q.url == url)
+    record = get_feeds_table().get(q.url == url)
     return FeedItem(**record) if record else None
 
 
+@timed_db
+@synchronized
 def add_feed(feed: FeedItem) -> bool:
     """
     Adds a new feed to the feeds table.
     Returns False if feed with same URL already exists.
     """
     q = Query()
-    if feeds_table.contains(q.url == feed.url):
+    if get_feeds_table().contains(q.url == feed.url):
         return False
-    feeds_table.insert(feed.dict())
+    get_feeds_table().insert(feed.dict())
     return True
 
 
+@timed_db
+@synchronized
 def update_feed(url: str, updates: dict) -> bool:
     """
     Updates a feed by URL.
@@ -88,20 +241,23 @@ def update_feed(url: str, updates: dict) -> bool:
     Returns True if at least one document was updated.
     """
     q = Query()
-    result = feeds_table.update(updates, q.url == url)
+    result = get_feeds_table().update(updates, q.url == url)
     return len(result) > 0
 
 
+@timed_db
+@synchronized
 def delete_feed(url: str) -> bool:
     """
     Deletes a feed by URL.
     Returns True if feed was deleted, False otherwise.
     """
     q = Query()
-    removed = feeds_table.remove(q.url == url)
+    removed = get_feeds_table().remove(q.url == url)
     return len(removed) > 0
 
 
+@synchronized
 def migrate_feeds_from_json(json_path: str = "feed.input.json") -> int:
     """
     Migrates feeds from feed.input.json to the feeds table.
@@ -109,7 +265,7 @@ def migrate_feeds_from_json(json_path: str = "feed.input.json") -> int:
     Returns the number of feeds migrated.
     """
     # Only migrate if feeds table is empty
-    if feeds_table.all():
+    if get_feeds_table().all():
         return 0
     
     # Try to load from the json file
@@ -130,9 +286,330 @@ def migrate_feeds_from_json(json_path: str = "feed.input.json") -> int:
                 feed_data['dry_run'] = global_dry_run
             
             feed = FeedItem(**feed_data)
-            feeds_table.insert(feed.dict())
+            get_feeds_table().insert(feed.dict())
             migrated += 1
         
         return migrated
     except (json.JSONDecodeError, Exception):
         return 0
+
+
+# ============== Subscriber Functions ==============
+
+@timed_db
+@synchronized
+def get_all_subscribers() -> list[Subscriber]:
+    """
+    Gets all subscribers from the subscribers table.
+    """
+    return [Subscriber(**r) for r in get_table('subscribers').all()]
+
+
+@timed_db
+@synchronized
+def add_subscriber(subscriber: Subscriber) -> bool:
+    """
+    Adds a subscriber. Returns False if one with the same email already exists.
+    """
+    q = Query()
+    subscribers = get_table('subscribers')
+    if subscribers.contains(q.email == subscriber.email):
+        return False
+    subscribers.insert(subscriber.dict())
+    return True
+
+
+@timed_db
+@synchronized
+def update_subscriber(email: str, updates: dict) -> bool:
+    """
+    Updates a subscriber by email.
+    updates: dict of fields to set, e.g. {'feeds': [...], 'active': False}
+    Returns True if at least one document was updated.
+    """
+    q = Query()
+    result = get_table('subscribers').update(updates, q.email == email)
+    return len(result) > 0
+
+
+@timed_db
+@synchronized
+def delete_subscriber(email: str) -> bool:
+    """
+    Deletes a subscriber by email.
+    Returns True if the subscriber was deleted, False otherwise.
+    """
+    q = Query()
+    removed = get_table('subscribers').remove(q.email == email)
+    return len(removed) > 0
+
+
+# ============== Outbox Functions ==============
+
+OUTBOX_PENDING = "pending"
+OUTBOX_SENDING = "sending"
+OUTBOX_SENT = "sent"
+OUTBOX_FAILED = "failed"
+
+@timed_db
+@synchronized
+def enqueue_outbox(key: str, batch: EmailBatch, recipient: str) -> bool:
+    """
+    Stages an email to recipient in the outbox under an idempotency key.
+    Returns False if an email with the same key was already staged, in any state.
+    """
+    q = Query()
+    outbox = get_table('outbox')
+    if outbox.contains(q.key == key):
+        return False
+    outbox.insert({
+        "key": key,
+        "batch": batch.dict(),
+        "recipient": recipient,
+        "status": OUTBOX_PENDING,
+        "attempts": 0,
+        "next_attempt": 0,
+        "claimed_at": 0,
+        "last_error": "",
+        "created": int(time.time()),
+        "sent_at": 0,
+    })
+    return True
+
+@timed_db
+@synchronized
+def claim_due_outbox(now: int, stale_before: int) -> list[dict]:
+    """
+    Marks every pending email whose retry time has come as sending and returns them.
+    Emails left in sending since before stale_before (a crash mid-send) are claimed again.
+    """
+    q = Query()
+    outbox = get_table('outbox')
+    condition = ((q.status == OUTBOX_PENDING) & (q.next_attempt <= now)) | \
+                ((q.status == OUTBOX_SENDING) & (q.claimed_at < stale_before))
+    records = outbox.search(condition)
+    if records:
+        outbox.update({"status": OUTBOX_SENDING, "claimed_at": now}, q.key.one_of([r["key"] for r in records]))
+    return records
+
+@timed_db
+@synchronized
+def mark_outbox_sent(key: str):
+    q = Query()
+    get_table('outbox').update({"status": OUTBOX_SENT, "sent_at": int(time.time()), "last_error": ""}, q.key == key)
+
+@timed_db
+@synchronized
+def mark_outbox_failed(key: str, attempts: int, next_attempt: int, error: str, give_up: bool):
+    """
+    Records a failed delivery, scheduling a retry at next_attempt unless give_up is set.
+    """
+    q = Query()
+    get_table('outbox').update({
+        "status": OUTBOX_FAILED if give_up else OUTBOX_PENDING,
+        "attempts": attempts,
+        "next_attempt": next_attempt,
+        "last_error": error,
+    }, q.key == key)
+
+@timed_db
+@synchronized
+def get_outbox() -> list[dict]:
+    """
+    Gets all outbox records, newest first.
+    """
+    return sorted(get_table('outbox').all(), key=lambda r: r["created"], reverse=True)
+
+@timed_db
+@synchronized
+def retry_failed_outbox() -> int:
+    """
+    Puts every email that ran out of attempts back in the queue.
+    Returns the number of emails requeued.
+    """
+    q = Query()
+    updated = get_table('outbox').update(
+        {"status": OUTBOX_PENDING, "attempts": 0, "next_attempt": 0},
+        q.status == OUTBOX_FAILED
+    )
+    return len(updated)
+
+
+# ============== Digest Functions ==============
+
+@timed_db
+@synchronized
+def add_digest_entry(entry: Entry, feed: FeedItem) -> bool:
+    """
+    Queues a cleaned chapter for the next digest of its feed.
+    Returns False if the chapter is already queued.
+    """
+    q = Query()
+    digest = get_table('digest')
+    if digest.contains(q.link == entry.link):
+        return False
+    entry_dict = entry.dict()
+    entry_dict["feed"] = feed.dict()
+    entry_dict["queued_at"] = int(time.time())
+    digest.insert(entry_dict)
+    return True
+
+@timed_db
+@synchronized
+def in_digest(entry: Entry) -> bool:
+    q = Query()
+    return get_table('digest').contains(q.link == entry.link)
+
+@timed_db
+@synchronized
+def get_digest_entries(feed_url: str) -> list[Entry]:
+    """
+    Gets the chapters queued for a feed's next digest, oldest first.
+    """
+    q = Query()
+    records = get_table('digest').search((q.feed.url == feed_url) & ~q.digest.exists())
+    return [Entry(**r) for r in sorted(records, key=lambda r: r["queued_at"])]
+
+@timed_db
+@synchronized
+def mark_digest_assembled(feed_url: str, links: list[str], digest_link: str):
+    """
+    Takes chapters out of the next digest of a feed while the digest they were assembled
+    into, digest_link, is being delivered. They stay queued so they aren't queued again.
+    """
+    q = Query()
+    get_table('digest').update({"digest": digest_link}, (q.feed.url == feed_url) & q.link.one_of(links))
+
+@timed_db
+@synchronized
+def clear_digest_entries(feed_url: str, links: list[str]):
+    q = Query()
+    get_table('digest').remove((q.feed.url == feed_url) & q.link.one_of(links))
+
+@timed_db
+@synchronized
+def get_last_digest(feed_url: str) -> int:
+    """
+    Gets when the last digest of a feed was assembled, 0 if never.
+    """
+    q = Query()
+    record = get_table('digest_log').get(q.url == feed_url)
+    return record["time"] if record else 0
+
+@timed_db
+@synchronized
+def set_last_digest(feed_url: str, timestamp: int):
+    q = Query()
+    get_table('digest_log').upsert({"url": feed_url, "time": timestamp}, q.url == feed_url)
+
+
+# ============== Patreon Recheck Functions ==============
+
+@timed_db
+@synchronized
+def schedule_patreon_recheck(entry: Entry, feed: FeedItem):
+    """
+    Queues a patreon-locked entry to be downloaded again when its lock expires.
+    """
+    q = Query()
+    get_table('patreon_rechecks').upsert({
+        "link": entry.link,
+        "due": entry.patreon_lock,
+        "entry": entry.dict(),
+        "feed": feed.dict(),
+    }, q.link == entry.link)
+
+@timed_db
+@synchronized
+def next_patreon_recheck() -> int | None:
+    """
+    Gets the earliest lock expiry in the queue, None if it is empty.
+    """
+    records = get_table('patreon_rechecks').all()
+    return min(r["due"] for r in records) if records else None
+
+@timed_db
+@synchronized
+def pop_due_patreon_rechecks(now: int) -> list[tuple[Entry, FeedItem]]:
+    """
+    Removes and returns the queued entries whose lock has expired, earliest first.
+    """
+    q = Query()
+    rechecks = get_table('patreon_rechecks')
+    records = sorted(rechecks.search(q.due <= now), key=lambda r: r["due"])
+    if records:
+        rechecks.remove(q.link.one_of([r["link"] for r in records]))
+    return [(Entry(**r["entry"]), FeedItem(**r["feed"])) for r in records]
+
+
+# ============== Artifact Functions ==============
+
+@timed_db
+@synchronized
+def get_all_artifacts() -> list[dict]:
+    """
+    Gets every artifact record: an entry link with the paths, sizes and hashes of its files.
+    """
+    return get_table('artifacts').all()
+
+@timed_db
+@synchronized
+def save_artifact(record: dict):
+    q = Query()
+    get_table('artifacts').upsert(record, q.link == record["link"])
+
+@timed_db
+@synchronized
+def delete_artifact(link: str):
+    q = Query()
+    get_table('artifacts').remove(q.link == link)
+
+@timed_db
+@synchronized
+def replace_artifacts(records: list[dict]):
+    """
+    Replaces the whole artifact table, in one write.
+    """
+    artifacts = get_table('artifacts')
+    artifacts.truncate()
+    artifacts.insert_multiple(records)
+
+
+# ============== TOC Snapshot Functions ==============
+
+@timed_db
+@synchronized
+def get_toc_snapshot(fiction_id: str) -> dict | None:
+    """
+    Gets the stored table of contents of a Royal Road fiction: its title, chapters in
+    order, fetch time, content hash and the chapter links known to be sent.
+    """
+    q = Query()
+    return get_table('toc_snapshots').get(q.fiction_id == fiction_id)
+
+@timed_db
+@synchronized
+def save_toc_snapshot(snapshot: dict):
+    q = Query()
+    get_table('toc_snapshots').upsert(snapshot, q.fiction_id == snapshot["fiction_id"])
+
+@timed_db
+@synchronized
+def mark_toc_sent(fiction_id: str, links: list[str]):
+    q = Query()
+    snapshot = get_table('toc_snapshots').get(q.fiction_id == fiction_id)
+    if snapshot:
+        sent = snapshot.get("sent", [])
+        sent.extend(link for link in links if link not in sent)
+        get_table('toc_snapshots').update({"sent": sent}, q.fiction_id == fiction_id)
+
+@synchronized
+def forget_toc_sent(link: str):
+    """
+    Makes a reverted chapter count as new again for its table of contents.
+    """
+    q = Query()
+    snapshots = get_table('toc_snapshots')
+    for snapshot in snapshots.search(q.sent.any([link])):
+        sent = [sent_link for sent_link in snapshot["sent"] if sent_link != link]
+        snapshots.update({"sent": sent}, q.fiction_id == snapshot["fiction_id"])
@@ -0,0 +1,99 @@
+import os
+import re
+from typing import List
+from urllib.parse import urlsplit
+from db import OUTBOX_FAILED, get_db, get_outbox, get_all_subscribers
+from mail import TO_EMAIL
+from models import FeedItem, Subscriber
+from outbox import recipients
+from utils import custom_logger
+
+CHAPTER_DEDUP = os.getenv("CHAPTER_DEDUP", "true") == "true"
+ROYAL_ROAD_CHAPTER_PATTERN = re.compile(r"royalroad\.com/fiction/(\d+)(?:/[^/?#]*)?/chapter/(\d+)")
+logger = custom_logger(__name__)
+
+
+def canonical_link(link: str) -> str:
+    """
+    Identifies a chapter however it was linked. Royal Road chapters by fiction and
+    chapter id, since the slugs in their urls follow the titles; other links without
+    scheme, www. and trailing slash.
+    """
+    match = ROYAL_ROAD_CHAPTER_PATTERN.search(link)
+    if match:
+        return f"royalroad:{match.group(1)}:{match.group(2)}"
+    parts = urlsplit(link.strip())
+    canonical = parts.netloc.lower().removeprefix("www.") + parts.path.rstrip("/")
+    if parts.query:
+        canonical += f"?{parts.query}"
+    if parts.fragment:
+        canonical += f"#{parts.fragment}"
+    return canonical
+
+
+class KnownChapters:
+    """
+    The chapters that were sent or are waiting in the outbox, by canonical link and by
+    the hash of their cleaned content, each with the recipients that got them.
+    """
+    def __init__(self, subscribers: List[Subscriber] = ()):
+        self.subscribers = list(subscribers)
+        self.links = {}
+        self.hashes = {}
+
+    def recipients(self, feed: FeedItem) -> List[str]:
+        return recipients(feed, self.subscribers)
+
+    def add(self, link: str, content_hash: str, addresses: List[str]):
+        for address in addresses:
+            self.links.setdefault(canonical_link(link), {}).setdefault(address, link)
+            if content_hash:
+                self.hashes.setdefault(content_hash, {}).setdefault(address, link)
+
+    def duplicate_of(self, link: str, content_hash: str, addresses: List[str]) -> str | None:
+        """
+        Returns the other link the same chapter was sent under, if every one of addresses
+        already got it. None if it is new to one of them.
+        """
+        if not addresses:
+            return None
+        for known, key in ((self.links, canonical_link(link)), (self.hashes, content_hash)):
+            if not key:
+                continue
+            earlier = known.get(key, {})
+            if all(address in earlier and earlier[address] != link for address in addresses):
+                return earlier[addresses[0]]
+        return None
+
+    def duplicate_for(self, feed: FeedItem, link: str, content_hash: str = "") -> str | None:
+        """
+        duplicate_of for everyone the feed is delivered to.
+        """
+        return self.duplicate_of(link, content_hash, self.recipients(feed))
+
+
+def known_chapters() -> KnownChapters:
+    """
+    Collects the sent and staged chapters in one pass over the entries and the outbox.
+    Entries recorded without an email in the outbox, from before the outbox or skipped
+    as duplicates, count as delivered to everyone their feed goes to now.
+    Empty when CHAPTER_DEDUP is disabled.
+    """
+    if not CHAPTER_DEDUP:
+        return KnownChapters()
+    known = KnownChapters(get_all_subscribers())
+    staged = set()
+    for record in get_outbox():
+        if record["status"] != OUTBOX_FAILED:
+            entry = record["batch"]["entry"]
+            known.add(entry["link"], entry.get("content_hash", ""), [record.get("recipient") or TO_EMAIL])
+            staged.add(entry["link"])
+    feed_recipients = {}
+    for record in get_db().all():
+        if record.get("time_sent") and record["link"] not in staged:
+            feed = record.get("feed") or {}
+            url = feed.get("url", "")
+            if url not in feed_recipients:
+                feed_recipients[url] = known.recipients(FeedItem(**feed)) if feed else [TO_EMAIL]
+            known.add(record["link"], record.get("content_hash", ""), feed_recipients[url])
+    return known
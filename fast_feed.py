@@ -0,0 +1,141 @@
+import os
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_tz, mktime_tz
+from typing import Callable, Iterable
+from feed_cache import FEED_FETCH_TIMEOUT_SECONDS
+from utils import custom_logger
+
+FAST_FEED_PARSER = os.getenv("FAST_FEED_PARSER", "true") == "true"
+# Consecutive already sent entries after which the rest of a newest-first feed is skipped
+FAST_FEED_SEEN_STOP = int(os.getenv("FAST_FEED_SEEN_STOP", "3"))
+ATOM_NAMESPACE = "{http://www.w3.org/2005/Atom}"
+DC_DATE = "{http://purl.org/dc/elements/1.1/}date"
+logger = custom_logger(__name__)
+
+
+class UnexpectedFeed(Exception):
+    """
+    The feed uses markup the fast path doesn't handle, feedparser has to read it.
+    """
+
+
+class ParsedFeed(dict):
+    """
+    The parts of a feedparser result the feeder uses: feed.title and entries with
+    title, link and published_parsed. complete is False when reading stopped at
+    entries that were already sent.
+    """
+    def __init__(self, title: str, entries: list[dict], complete: bool):
+        super().__init__(bozo=False, entries=entries, feed={"title": title})
+        self.feed = self["feed"]
+        self.complete = complete
+
+
+def _text(element) -> str | None:
+    if element is None:
+        return None
+    if len(element):
+        raise UnexpectedFeed(f"markup inside {element.tag}")
+    return (element.text or "").strip()
+
+
+def _rss_date(text: str) -> tuple:
+    parsed = parsedate_tz(text)
+    if parsed is None:
+        raise UnexpectedFeed(f"date {text!r}")
+    return tuple(time.gmtime(mktime_tz(parsed)))
+
+
+def _iso_date(text: str) -> tuple:
+    try:
+        parsed = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        raise UnexpectedFeed(f"date {text!r}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return tuple(parsed.utctimetuple())
+
+
+def _rss_entry(item) -> dict:
+    title, link = _text(item.find("title")), _text(item.find("link"))
+    pub_date, dc_date = _text(item.find("pubDate")), _text(item.find(DC_DATE))
+    if not title or not link or not (pub_date or dc_date):
+        raise UnexpectedFeed("item without title, link or date")
+    published = _rss_date(pub_date) if pub_date else _iso_date(dc_date)
+    return {"title": title, "link": link, "published_parsed": published}
+
+
+def _atom_entry(entry) -> dict:
+    title_element = entry.find(f"{ATOM_NAMESPACE}title")
+    if title_element is not None and title_element.get("type", "text") != "text":
+        raise UnexpectedFeed(f"{title_element.get('type')} title")
+    title = _text(title_element)
+    link = None
+    for element in entry.iterfind(f"{ATOM_NAMESPACE}link"):
+        if element.get("rel", "alternate") == "alternate":
+            link = (element.get("href") or "").strip()
+            break
+    # feedparser only sets published_parsed from published, not updated
+    published = _text(entry.find(f"{ATOM_NAMESPACE}published"))
+    if not title or not link or not published:
+        raise UnexpectedFeed("entry without title, link or published date")
+    return {"title": title, "link": link, "published_parsed": _iso_date(published)}
+
+
+def parse_feed(chunks: Iterable[bytes], seen: Callable[[dict], bool]) -> ParsedFeed:
+    """
+    Reads the title, link and date of each entry of an RSS 2.0 or Atom feed while
+    it streams in. Feeds list the newest entry first, so once FAST_FEED_SEEN_STOP
+    entries in a row were already sent, the rest of the document is not read.
+    Raises UnexpectedFeed or a parse error on anything else.
+    """
+    from lxml import etree
+
+    parser = etree.XMLPullParser(events=("start", "end"), resolve_entities=False, no_network=True)
+    title, entries, root, consecutive_seen = None, [], None, 0
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            if root is None:
+                root = element
+                if element.tag not in ("rss", f"{ATOM_NAMESPACE}feed"):
+                    raise UnexpectedFeed(f"root element {element.tag}")
+            if event != "end":
+                continue
+            if element.tag in ("item", f"{ATOM_NAMESPACE}entry"):
+                entry = _rss_entry(element) if element.tag == "item" else _atom_entry(element)
+                entries.append(entry)
+                # Parsed entries are no longer needed in the tree
+                element.clear()
+                consecutive_seen = consecutive_seen + 1 if seen(entry) else 0
+                if title is not None and consecutive_seen >= FAST_FEED_SEEN_STOP:
+                    return ParsedFeed(title, entries, complete=False)
+            elif element.tag in ("title", f"{ATOM_NAMESPACE}title") and title is None:
+                parent = element.getparent()
+                if parent is not None and parent.tag in ("channel", f"{ATOM_NAMESPACE}feed"):
+                    title = _text(element)
+    parser.close()
+    if root is None:
+        raise UnexpectedFeed("empty document")
+    return ParsedFeed(title or "", entries, complete=True)
+
+
+def read_feed(url: str, seen: Callable[[dict], bool]) -> ParsedFeed | None:
+    """
+    Downloads and reads a feed with parse_feed, closing the connection once the
+    remaining entries are known to be sent. Returns None when the feed couldn't be
+    read this way, in which case callers fall back to feedparser.
+    """
+    import requests
+
+    try:
+        with requests.get(url, stream=True, timeout=FEED_FETCH_TIMEOUT_SECONDS) as response:
+            response.raise_for_status()
+            parsed = parse_feed(response.iter_content(chunk_size=16 * 1024), seen)
+    except Exception as e:
+        logger.info(f"Reading {url} with feedparser: {e}")
+        return None
+    if not parsed.complete:
+        logger.debug(f"Stopped reading {url} after {len(parsed['entries'])} entries")
+    return parsed
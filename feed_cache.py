@@ -0,0 +1,100 @@
+import os
+import re
+import threading
+import time
+from utils import custom_logger
+
+FEED_CACHE_TTL_SECONDS = int(os.getenv("FEED_CACHE_TTL_SECONDS", 60 * 15))
+FEED_TITLE_MAX_BYTES = int(os.getenv("FEED_TITLE_MAX_BYTES", 64 * 1024))
+FEED_FETCH_TIMEOUT_SECONDS = int(os.getenv("FEED_FETCH_TIMEOUT_SECONDS", "20"))
+logger = custom_logger(__name__)
+
+# The first closing title tag after the channel/feed element belongs to the feed itself
+TITLE_END_PATTERN = re.compile(rb"<(?:channel|feed)\b.*?</title\s*>", re.DOTALL | re.IGNORECASE)
+
+
+class TTLCache:
+    """
+    A small thread-safe in-memory cache whose entries expire after ttl seconds.
+    """
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# Feed url -> {"title": str, "fetched_at": int}
+FEED_METADATA_CACHE = TTLCache(FEED_CACHE_TTL_SECONDS)
+
+
+def remember_feed(url: str, parsed) -> None:
+    """
+    Stores the metadata of an already parsed feed so later title lookups are free.
+    """
+    title = parsed.feed.get("title", "") if parsed is not None else ""
+    if title:
+        FEED_METADATA_CACHE.set(url, {"title": title, "fetched_at": int(time.time())})
+
+
+def _fetch_feed_head(url: str) -> bytes:
+    """
+    Downloads the feed only until the channel title has been received.
+    """
+    import requests
+
+    with requests.get(url, stream=True, timeout=FEED_FETCH_TIMEOUT_SECONDS) as response:
+        response.raise_for_status()
+        content = b""
+        for chunk in response.iter_content(chunk_size=4096):
+            content += chunk
+            if TITLE_END_PATTERN.search(content) or len(content) >= FEED_TITLE_MAX_BYTES:
+                break
+        return content
+
+
+def fetch_feed_title(url: str) -> str:
+    """
+    Returns the title of a feed, served from the metadata cache when possible.
+    Only the head of the document is downloaded; if the title can't be read from it
+    the whole feed is parsed as a fallback.
+    Blocking, callers on the event loop should run it in a thread.
+    """
+    cached = FEED_METADATA_CACHE.get(url)
+    if cached:
+        return cached["title"]
+
+    import feedparser
+    import requests
+
+    parsed = None
+    try:
+        parsed = feedparser.parse(_fetch_feed_head(url))
+    except requests.RequestException as e:
+        logger.warning(f"Partial fetch of {url} failed, falling back to full parse: {e}")
+
+    if parsed is None or not parsed.feed.get("title"):
+        parsed = feedparser.parse(url)
+        if parsed.bozo and not parsed.entries:
+            raise ValueError("Could not parse feed URL")
+
+    remember_feed(url, parsed)
+    return parsed.feed.get("title", "")
@@ -1,16 +1,32 @@
+import hashlib
 import json
 import os
+import threading
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
-from db import add_entry, has_entry, get_all_feeds, migrate_feeds_from_json
+from db import (
+    add_entry, has_entry, get_all_feeds, update_feed, migrate_feeds_from_json,
+    add_digest_entry, in_digest, get_digest_entries, mark_digest_assembled, get_last_digest, set_last_digest,
+    get_sent_links, get_toc_snapshot, save_toc_snapshot, mark_toc_sent
+)
 from models import EmailBatch, Entry, EntryType, Feed, FeedItem
-import feedparser
-import requests
-from requests_html import HTMLSession
-from bs4 import BeautifulSoup
-from utils import custom_logger
+from utils import custom_logger, log_context
 from mail import send_gmail
-import pypandoc
+from feed_cache import remember_feed
+from fast_feed import FAST_FEED_PARSER, read_feed
+from metrics import timed, site_of, STAGE_ERRORS, CHAPTER_BYTES
+from compact import compact_html
+from images import EMBED_IMAGES, embed_images
+from outbox import stage_emails, drain_outbox, record_delivery
+from recheck import schedule_recheck
+from artifacts import MANIFEST, artifact_paths
+from leases import LeaseSet
+from search import index_chapter
+from dedup import CHAPTER_DEDUP, KnownChapters, known_chapters
+from converter import PANDOC_WORKERS, convert_html_to_epub
+from site_rules import SITE_RULES, clean_page
 import re
 
 WANDERING_INN_URL_FRAGMENT = os.getenv("WANDERING_INN_URL_FRAGMENT", "wanderinginn")
@@ -18,8 +34,27 @@ DATA_PATH = os.getenv("DATA_PATH", "/data")
 DEBUG_MODE = os.getenv("DEBUG_MODE", "false") == "true"
 MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "20"))
 ENTRY_THRESHOLD_FOR_NEW_BOOK = int(os.getenv("ENTRY_THRESHOLD_FOR_NEW_BOOK", "5"))
+ROYAL_ROAD_BASE_URL = os.getenv("ROYAL_ROAD_BASE_URL", "https://www.royalroad.com")
+# A stored table of contents younger than this is used without fetching the fiction page
+ROYAL_ROAD_TOC_TTL_SECONDS = int(os.getenv("ROYAL_ROAD_TOC_TTL_SECONDS", "3600"))
+TOC_TABLE_PATTERN = re.compile(r'<table[^>]*\bid="chapters".*?</table>', re.S)
+TOC_TITLE_PATTERN = re.compile(r'<h1[^>]*\bfont-white\b[^>]*>.*?</h1>', re.S)
+TOC_LINK_PATTERN = re.compile(r'<a[^>]*href="(/fiction/\d+/[^"/]+/chapter/\d+)"[^>]*>([^<]*)<')
+COMPACT_OUTPUT = os.getenv("COMPACT_OUTPUT", "true") == "true"
+# "rules" cleans with the lxml site rules in site_rules.py, "soup" with the BeautifulSoup cleaners below
+CLEANING_ENGINE = os.getenv("CLEANING_ENGINE", "rules")
+DIGEST_MODE = os.getenv("DIGEST_MODE", "false") == "true"
+DIGEST_SEND_TIME = os.getenv("DIGEST_SEND_TIME", "06:00")
+DIGEST_MAX_CHAPTERS = int(os.getenv("DIGEST_MAX_CHAPTERS", "10"))
+# Consecutive failed runs before a feed is paused, and how long the pause lasts (doubled every further failure)
+FEED_FAILURE_THRESHOLD = int(os.getenv("FEED_FAILURE_THRESHOLD", "3"))
+FEED_COOLDOWN_BASE_SECONDS = int(os.getenv("FEED_COOLDOWN_BASE_SECONDS", 15 * 60))
+FEED_COOLDOWN_MAX_SECONDS = int(os.getenv("FEED_COOLDOWN_MAX_SECONDS", 24 * 3600))
 logger = custom_logger(__name__)
 
+# Held by a feed cycle and by patreon rechecks, so they never work on the same files at once
+PIPELINE_LOCK = threading.Lock()
+
 def normalize_royal_road_url(url: str) -> str:
     """
     Converts a Royal Road fiction page URL to its RSS syndication URL.
@@ -38,8 +73,18 @@ def normalize_royal_road_url(url: str) -> str:
         return f"{base}/fiction/syndication/{fiction_id}"
     return url
 
-with open("./keywords.txt", 'r') as file:
-    KEYWORDS_TO_REMOVE = [line.strip() for line in file if line.strip()]
+KEYWORDS_TO_REMOVE: List[str] = []
+
+def load_keywords() -> List[str]:
+    """
+    Reads the watermark keywords from keywords.txt on first use.
+    Called from the app startup hook so the first cycle doesn't pay for it.
+    """
+    global KEYWORDS_TO_REMOVE
+    if not KEYWORDS_TO_REMOVE:
+        with open("./keywords.txt", 'r') as file:
+            KEYWORDS_TO_REMOVE = [line.strip() for line in file if line.strip()]
+    return KEYWORDS_TO_REMOVE
 
 def get_feed_list() -> Feed:
     """
@@ -74,6 +119,8 @@ def is_patreon_locked(entry: Entry, html_file_path: str) -> bool:
     Checks if the downloaded HTML file contains a patreon-protected-post div.
     Returns True if the content is patreon-locked.
     """
+    from bs4 import BeautifulSoup
+
     try:
         if not os.path.exists(html_file_path):
             return False
@@ -96,31 +143,37 @@ def download(entry: Entry, feed: FeedItem):
     """
     Downloads the content of an entry to disk.
     """
-    feed_path = os.path.join(DATA_PATH, sanitize_filename(feed.title))
-    html_download_path = os.path.join(feed_path, "html")
-    os.makedirs(feed_path, exist_ok=True)
-    os.makedirs(html_download_path, exist_ok=True)
-    html_file_path = os.path.join(html_download_path, f"{sanitize_filename(entry.title)}.html")
-    if os.path.exists(html_file_path):
+    html_file_path = artifact_paths(entry.title, feed.title)["raw"]
+    if MANIFEST.has(entry.link, "raw", html_file_path):
         return
+    MANIFEST.ensure_directory(os.path.dirname(html_file_path))
     logger.info(f"Downloading content from {entry.link} to {html_file_path}")
-    session = HTMLSession()
-    response = session.get(entry.link)
-    response.raise_for_status()
-    with open(html_file_path, "w") as f:
-        f.write(response.html.html)
+    from requests_html import HTMLSession
+    with timed("download", feed.name, site_of(entry.link)):
+        session = HTMLSession()
+        response = session.get(entry.link)
+        response.raise_for_status()
+        html_content = response.html.html
+        with open(html_file_path, "w") as f:
+            f.write(html_content)
     logger.info(f"Downloaded content {html_file_path}")
     
     if is_patreon_locked(entry, html_file_path):
         entry.set_patreon_lock()
         add_entry(entry, feed)
+        schedule_recheck(entry, feed)
         os.remove(html_file_path)
         logger.info(f"Removed patreon-locked file: {html_file_path}")
+        return
+    MANIFEST.record(entry, feed, "raw", html_file_path, html_content.encode("utf-8"))
 
-def clean_wandering_inn(html_content: str) -> str:
+def clean_wandering_inn(html_content: str, page_url: str = "") -> str:
     """
     Cleans the downloaded content of a Wandering Inn entry.
+    Images are removed, or shrunk and embedded when EMBED_IMAGES is enabled.
     """
+    from bs4 import BeautifulSoup
+
     soup = BeautifulSoup(html_content, "lxml")
 
     article = soup.find("div", class_="reader-container")
@@ -137,17 +190,24 @@ def clean_wandering_inn(html_content: str) -> str:
         element.extract()
     for element in entry_content.find_all('span', class_='embed-youtube'):  # Consistent style
         element.extract()
-    for element in entry_content.find_all('img'):
-        element.extract()
-    for element in entry_content.find_all('div', class_='gallery'):  # Consistent style
-        element.extract()
+    if EMBED_IMAGES:
+        embed_images(entry_content, page_url)
+    else:
+        for element in entry_content.find_all('img'):
+            element.extract()
+        for element in entry_content.find_all('div', class_='gallery'):  # Consistent style
+            element.extract()
 
+    if COMPACT_OUTPUT:
+        return compact_html(entry_content)
     return entry_content.prettify()
 
 def clean_royal_road(html_content: str, keywords_to_remove: List[str]) -> str:
     """
     Cleans the downloaded content of a Royal Road entry.
     """
+    from bs4 import BeautifulSoup
+
     soup = BeautifulSoup(html_content, "lxml")
     chapter_div = soup.find("div", class_="chapter-inner chapter-content")
     if not chapter_div:
@@ -169,79 +229,117 @@ def clean_royal_road(html_content: str, keywords_to_remove: List[str]) -> str:
                 break
     if not extracted:
         logger.warn("Could not find any paragraphs matching criteria")
+    if COMPACT_OUTPUT:
+        return compact_html(chapter_div)
     return str(chapter_div) if chapter_div else ""
 
 def clean(entry: Entry, feed: FeedItem):
     """
     Cleans the downloaded content of an entry.
     """
-    feed_path = os.path.join(DATA_PATH, sanitize_filename(feed.title))
-    html_download_path = os.path.join(feed_path, "html")
-    html_file_path = os.path.join(html_download_path, f"{sanitize_filename(entry.title)}.html")
-    cleaned_download_path = os.path.join(feed_path, "cleaned")
-    cleaned_file_path = os.path.join(cleaned_download_path, f"{sanitize_filename(entry.title)}.html")
-    os.makedirs(cleaned_download_path, exist_ok=True)
-    if os.path.exists(cleaned_file_path):
+    paths = artifact_paths(entry.title, feed.title)
+    html_file_path, cleaned_file_path = paths["raw"], paths["cleaned"]
+    if MANIFEST.has(entry.link, "cleaned", cleaned_file_path):
         return
+    MANIFEST.ensure_directory(os.path.dirname(cleaned_file_path))
     logger.info(f"Cleaning content from {html_file_path}")
-    with open(html_file_path, "r") as f:
-        html_content = f.read()
-    if entry.entryType == EntryType.wanderinginn:
-        cleaned_html = clean_wandering_inn(html_content)
-    elif entry.entryType == EntryType.royalroad:
-        cleaned_html = clean_royal_road(html_content, KEYWORDS_TO_REMOVE)
-    else:
-        cleaned_html = html_content
-    with open(cleaned_file_path, "w") as f:
-        f.write(cleaned_html)
-    logger.info(f"Cleaned content saved to {cleaned_file_path}")
+    with timed("clean", feed.name, site_of(entry.link)):
+        with open(html_file_path, "r") as f:
+            html_content = f.read()
+        if CLEANING_ENGINE == "rules" and entry.entryType.value in SITE_RULES:
+            cleaned_html = clean_page(
+                html_content,
+                SITE_RULES[entry.entryType.value],
+                page_url=entry.link,
+                keywords=load_keywords(),
+                embed_images=EMBED_IMAGES,
+                compact=COMPACT_OUTPUT,
+            )
+        elif entry.entryType == EntryType.wanderinginn:
+            cleaned_html = clean_wandering_inn(html_content, entry.link)
+        elif entry.entryType == EntryType.royalroad:
+            cleaned_html = clean_royal_road(html_content, load_keywords())
+        else:
+            cleaned_html = html_content
+        with open(cleaned_file_path, "w") as f:
+            f.write(cleaned_html)
+    cleaned_data = cleaned_html.encode("utf-8")
+    MANIFEST.record(entry, feed, "cleaned", cleaned_file_path, cleaned_data)
+    try:
+        with timed("index", feed.name, site_of(entry.link)):
+            index_chapter(entry.link, entry.title, feed.title, cleaned_file_path, cleaned_html)
+    except Exception as e:
+        logger.exception(f"Could not add {entry.title} to the search index: {e}")
+    raw_size, cleaned_size = len(html_content.encode("utf-8")), len(cleaned_data)
+    CHAPTER_BYTES.observe(raw_size, stage="raw", feed=feed.name, site=site_of(entry.link))
+    CHAPTER_BYTES.observe(cleaned_size, stage="cleaned", feed=feed.name, site=site_of(entry.link))
+    logger.info(f"Cleaned content saved to {cleaned_file_path} ({raw_size} -> {cleaned_size} bytes)")
 
 def convert_to_epub(entry: Entry, feed: FeedItem):
     """
     Converts the cleaned content of an entry to an EPUB file.
     """
-    feed_path = os.path.join(DATA_PATH, sanitize_filename(feed.title))
-    cleaned_html_path = os.path.join(feed_path, "cleaned", f"{sanitize_filename(entry.title)}.html")
-    epub_file_path_no_space = os.path.join(feed_path, f"{sanitize_filename(entry.get_file_name())}.epub")
-    epub_file_path = os.path.join(feed_path, f"{sanitize_filename(entry.title)}.epub")
-    if os.path.exists(epub_file_path):
+    paths = artifact_paths(entry.title, feed.title)
+    cleaned_html_path, epub_file_path = paths["cleaned"], paths["epub"]
+    epub_file_path_no_space = os.path.join(os.path.dirname(epub_file_path), f"{sanitize_filename(entry.get_file_name())}.epub")
+    if MANIFEST.has(entry.link, "epub", epub_file_path):
         return
     logger.info(f"Converting cleaned content from {cleaned_html_path} to EPUB")
-
-    extra_args = [
-        '--metadata', f'title={entry.title}',
-        '--metadata', 'lang=en-US',
-        '--css', "./epub.css",
-        '--epub-title-page=false'
-    ]
-
-    pypandoc.convert_file(
-        cleaned_html_path,
-        'epub',
-        outputfile=epub_file_path_no_space,
-        extra_args=extra_args
-    )
+    with timed("convert", feed.name, site_of(entry.link)):
+        convert_html_to_epub(cleaned_html_path, epub_file_path_no_space, entry.title)
     os.rename(epub_file_path_no_space, epub_file_path)
-    logger.info(f"EPUB file saved to {epub_file_path}")
+    MANIFEST.record(entry, feed, "epub", epub_file_path)
+    epub_size = os.path.getsize(epub_file_path)
+    CHAPTER_BYTES.observe(epub_size, stage="epub", feed=feed.name, site=site_of(entry.link))
+    logger.info(f"EPUB file saved to {epub_file_path} ({epub_size} bytes)")
 
-def prepare_email(entry: Entry, feed: FeedItem):
+def prepare_email(entry: Entry, feed: FeedItem, known: KnownChapters | None = None):
     """
-    Prepares an email for sending by validating the EPUB file exists and entry hasn't been sent.
+    Prepares an email for sending by validating the EPUB file exists and entry hasn't been sent,
+    under its link or, going by its link's chapter id or its cleaned content, under another one.
     Returns None if the email shouldn't be sent.
     """
-    feed_path = os.path.join(DATA_PATH, sanitize_filename(feed.title))
-    epub_file_path = os.path.join(feed_path, f"{sanitize_filename(entry.title)}.epub")
+    epub_file_path = artifact_paths(entry.title, feed.title)["epub"]
     
-    if not os.path.exists(epub_file_path):
+    if not MANIFEST.has(entry.link, "epub", epub_file_path):
         logger.error(f"EPUB file not found: {epub_file_path}")
         return None
     if has_entry(entry):
         return None
+    if CHAPTER_DEDUP:
+        known = known if known is not None else known_chapters()
+        cleaned = MANIFEST.artifact(entry.link, "cleaned")
+        entry.content_hash = cleaned["sha256"] if cleaned and cleaned["size"] else ""
+        duplicate = known.duplicate_for(feed, entry.link, entry.content_hash)
+        if duplicate:
+            logger.info(f"Not sending {entry.title}, the same chapter was sent as {duplicate}")
+            entry.time_sent = int(time.time())
+            add_entry(entry, feed)
+            return None
     return EmailBatch(entry=entry, feed=feed, epub_path=epub_file_path)
 
+def drop_duplicates(entries: List[Entry], feed: FeedItem, known: KnownChapters) -> List[Entry]:
+    """
+    Leaves out entries whose chapter was already sent under another link to everyone
+    the feed goes to, e.g. with an edited title or found through the table of contents,
+    before anything is downloaded. They are recorded as sent so later runs skip them.
+    """
+    kept = []
+    for entry in entries:
+        duplicate = known.duplicate_for(feed, entry.link)
+        if duplicate:
+            logger.info(f"Skipping {entry.title}, the same chapter was sent as {duplicate}")
+            entry.time_sent = int(time.time())
+            add_entry(entry, feed)
+            continue
+        kept.append(entry)
+    return kept
+
 def send_batch_emails(email_batch: List[EmailBatch], feed: Feed):
     """
-    Sends all emails in the batch and records them in the database.
+    Stages all emails in the batch in the outbox and sends every email that is due,
+    including retries of earlier failures. Entries are recorded in the database
+    once their email has been delivered.
     """
 
     if len(email_batch) > MAX_BATCH_SIZE:
@@ -249,36 +347,25 @@ def send_batch_emails(email_batch: List[EmailBatch], feed: Feed):
         for batch in email_batch:
             if batch.feed.dry_run:
                 add_entry(batch.entry, batch.feed)
-        return
-
-    if len(email_batch) == 0:
-        return
-
-    logger.info(f"Preparing to send {len(email_batch)} emails")
-    
-    if feed.dry_run:
+    elif feed.dry_run:
         for batch in email_batch:
             logger.info(f"DRY RUN: Would have sent email with EPUB file: {batch.epub_path}")
-            batch.entry.time_sent = int(time.time())
-            add_entry(batch.entry, batch.feed)
-    else:
-        for batch in email_batch:
-            logger.info(f"Sending email with EPUB file: {batch.epub_path}")
-            send_gmail(
-                subject=f"{batch.feed.title} - {batch.entry.title}",
-                content=f"EPUB file for {batch.entry.title} is attached.",
-                attachment_path=batch.epub_path
-            )
-            batch.entry.time_sent = int(time.time())
-            add_entry(batch.entry, batch.feed)
+            record_delivery(batch)
+    elif email_batch:
+        logger.info(f"Preparing to send {len(email_batch)} emails")
+        # Judged per recipient, the same chapter can come from two feeds of one cycle
+        staged = stage_emails(email_batch, known_chapters() if CHAPTER_DEDUP else None)
+        logger.info(f"Staged {staged} new emails in the outbox")
+
+    if not feed.dry_run:
+        drain_outbox()
 
 def send_email(entry: Entry, feed: FeedItem):
     """
     Sends an email with the EPUB file attached.
     """
-    feed_path = os.path.join(DATA_PATH, sanitize_filename(feed.title))
-    epub_file_path = os.path.join(feed_path, f"{sanitize_filename(entry.title)}.epub")
-    if not os.path.exists(epub_file_path):
+    epub_file_path = artifact_paths(entry.title, feed.title)["epub"]
+    if not MANIFEST.has(entry.link, "epub", epub_file_path):
         logger.error(f"EPUB file not found: {epub_file_path}")
         return
     if has_entry(entry):
@@ -287,117 +374,247 @@ def send_email(entry: Entry, feed: FeedItem):
         logger.info(f"DRY RUN: Would have sent email with EPUB file: {epub_file_path}")
     else:
         logger.info(f"Sending email with EPUB file: {epub_file_path}")
-        send_gmail(
-            subject=f"{feed.title} - {entry.title}",
-            content=f"EPUB file for {entry.title} is attached.",
-            attachment_path=epub_file_path
-        )
+        with timed("send", feed.name, site_of(entry.link)):
+            sent = send_gmail(
+                subject=f"{feed.title} - {entry.title}",
+                content=f"EPUB file for {entry.title} is attached.",
+                attachment_path=epub_file_path
+            )
+        if not sent:
+            STAGE_ERRORS.inc(stage="send", feed=feed.name, site=site_of(entry.link))
     entry.time_sent = int(time.time())
     add_entry(entry, feed)
 
-def get_royal_road_chapters(feed_url: str) -> List[Entry]:
+def parse_royal_road_toc(html: str) -> tuple[str, list[dict]] | None:
+    """
+    Reads the book title and the chapters, in table order, from a Royal Road fiction page.
+    Returns None if the page has no chapters table.
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "lxml")
+
+    # Find the table of contents - Royal Road uses <table id="chapters">
+    chapters_table = soup.find("table", id="chapters")
+    if not chapters_table:
+        return None
+
+    # Get the book title
+    title_element = soup.find("h1", class_="font-white")
+    book_title = title_element.get_text(strip=True) if title_element else "Unknown Book"
+
+    chapters = []
+    for row in chapters_table.find_all("tr"):
+        # Find the link in the row
+        link = row.find("a", href=re.compile(r"/fiction/\d+/[^/]+/chapter/\d+"))
+        if not link:
+            continue
+        chapters.append({"title": link.get_text(strip=True), "link": ROYAL_ROAD_BASE_URL + link['href']})
+    return book_title, chapters
+
+def toc_hash(html: str) -> str | None:
+    """
+    Hashes what the table of contents is read from: the title heading and the chapter
+    links with their names. The rest of a fiction page, like tokens, ads, counters and
+    relative release dates, changes between requests. None if there is no chapters table.
+    """
+    table = TOC_TABLE_PATTERN.search(html)
+    if not table:
+        return None
+    title = TOC_TITLE_PATTERN.search(html)
+    content = json.dumps([title.group(0) if title else "", TOC_LINK_PATTERN.findall(table.group(0))])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def royal_road_chapter_id(link: str) -> str:
+    match = re.search(r'/chapter/(\d+)', link)
+    return match.group(1) if match else link
+
+def royal_road_toc(fiction_id: str, expected_links: List[str] = ()) -> dict | None:
+    """
+    Returns the stored table of contents of a fiction. The fiction page is only fetched
+    again once the snapshot is older than ROYAL_ROAD_TOC_TTL_SECONDS or lacks one of
+    expected_links (compared by chapter id), and only parsed again when its chapters changed.
+    Returns None if the page has no chapters table.
     """
-    Scrapes the Royal Road table of contents page to get all chapter links.
-    Extracts the fiction ID from the RSS feed URL and constructs the main page URL.
+    from requests_html import HTMLSession
+
+    snapshot = get_toc_snapshot(fiction_id)
+    now = int(time.time())
+    if snapshot and now - snapshot["fetched_at"] < ROYAL_ROAD_TOC_TTL_SECONDS:
+        snapshot_ids = {royal_road_chapter_id(chapter["link"]) for chapter in snapshot["chapters"]}
+        if all(royal_road_chapter_id(link) in snapshot_ids for link in expected_links):
+            return snapshot
+
+    fiction_url = f"{ROYAL_ROAD_BASE_URL}/fiction/{fiction_id}"
+    logger.info(f"Scraping Royal Road table of contents from {fiction_url}")
+    with timed("toc_fetch", site="royalroad.com"):
+        session = HTMLSession()
+        response = session.get(fiction_url)
+        response.raise_for_status()
+    html = response.html.html
+    content_hash = toc_hash(html)
+
+    if snapshot and content_hash and snapshot["hash"] == content_hash:
+        snapshot["fetched_at"] = now
+    else:
+        parsed = parse_royal_road_toc(html)
+        if parsed is None:
+            return None
+        title, chapters = parsed
+        snapshot = {
+            "fiction_id": fiction_id,
+            "title": title,
+            "chapters": chapters,
+            "hash": content_hash,
+            "fetched_at": now,
+            "sent": snapshot.get("sent", []) if snapshot else [],
+        }
+    save_toc_snapshot(snapshot)
+    return snapshot
+
+def get_royal_road_chapters(feed_url: str, expected_links: List[str] = ()) -> List[Entry] | None:
+    """
+    Returns the chapters of a Royal Road book that weren't sent yet, in table of contents order.
+    Extracts the fiction ID from the RSS feed URL. Chapters are diffed against the ones
+    its snapshot already knows were sent, so only new chapters are looked up.
+    Returns None if the table of contents couldn't be read.
     """
     try:
         # Extract fiction ID from RSS URL (e.g., /fiction/syndication/36049 -> 36049)
         fiction_id_match = re.search(r'/fiction/syndication/(\d+)', feed_url)
         if not fiction_id_match:
             logger.error(f"Could not extract fiction ID from URL: {feed_url}")
-            return []
-        
+            return None
+
         fiction_id = fiction_id_match.group(1)
-        fiction_url = f"https://www.royalroad.com/fiction/{fiction_id}"
-        
-        logger.info(f"Scraping Royal Road table of contents from {fiction_url}")
-        
-        session = HTMLSession()
-        response = session.get(fiction_url)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.html.html, "lxml")
-        
-        # Find the table of contents - Royal Road uses <table id="chapters">
-        chapters_table = soup.find("table", id="chapters")
-        if not chapters_table:
+        snapshot = royal_road_toc(fiction_id, expected_links)
+        if snapshot is None:
             logger.error("Could not find chapters table on Royal Road page")
-            return []
-        
-        # Get the book title
-        title_element = soup.find("h1", class_="font-white")
-        book_title = title_element.get_text(strip=True) if title_element else "Unknown Book"
-        
+            return None
+
+        # A table of contents that lags behind the feed would hide its new chapters
+        toc_chapters = {royal_road_chapter_id(chapter["link"]) for chapter in snapshot["chapters"]}
+        missing = [link for link in expected_links if royal_road_chapter_id(link) not in toc_chapters]
+        if missing:
+            logger.warning(f"Royal Road table of contents is missing {len(missing)} chapters of the feed")
+            return None
+
+        known_sent = set(snapshot["sent"])
+        new_chapters = [chapter for chapter in snapshot["chapters"] if chapter["link"] not in known_sent]
+        sent, locked = get_sent_links([chapter["link"] for chapter in new_chapters])
+        if sent:
+            mark_toc_sent(fiction_id, sorted(sent))
+
         entries = []
-        # Find all chapter rows in the table
-        chapter_rows = chapters_table.find_all("tr")
-        
-        for row in chapter_rows:
-            # Find the link in the row
-            link = row.find("a", href=re.compile(r"/fiction/\d+/[^/]+/chapter/\d+"))
-            if not link:
+        for chapter in new_chapters:
+            # Patreon-locked chapters are waiting for a recheck
+            if chapter["link"] in sent or chapter["link"] in locked:
                 continue
-                
-            chapter_url = "https://www.royalroad.com" + link['href']
-            chapter_title = link.get_text(strip=True)
-            
             # Create Entry object with current timestamp for published_parsed
-            entry = Entry(
-                title=chapter_title,
-                link=chapter_url,
+            entries.append(Entry(
+                title=chapter["title"],
+                link=chapter["link"],
                 entryType=EntryType.royalroad,
                 published_parsed=time.localtime()
-            )
-            entries.append(entry)
-        
-        logger.info(f"Found {len(entries)} chapters on Royal Road table of contents")
+            ))
+
+        logger.info(f"Found {len(entries)} new of {len(snapshot['chapters'])} chapters on Royal Road table of contents")
         return entries
-        
+
     except Exception as e:
         logger.exception(f"Error scraping Royal Road table of contents: {e}")
-        return []
+        return None
 
-def process_entry(entry: Entry, feed: FeedItem, skip_email_prep: bool = False, skip_date: bool = False):
+def strip_tags(title: str) -> str:
     """
-    Processes a single entry in a feed.
+    Removes [...] tags like [Patreon] from a feed or entry title.
     """
-    try:
-        feed.title = re.sub(r"\[.*?\]", "", feed.title)
-        feed.title = feed.title.strip()
-        entry.title = re.sub(r"\[.*?\]", "", entry.title)
-        entry.title = entry.title.strip()
-        if WANDERING_INN_URL_FRAGMENT in entry.link:
-            entry.entryType = EntryType.wanderinginn
-            entry.title = feed.title + " - " + entry.title
-            if entry.ignore():
-                logger.info(f"Ignoring entry: {entry.title}")
-                return
-            if has_entry(entry):
-                return
-        if not skip_date:
-            entry.title = entry.get_date() + " - " + entry.title
-        download(entry, feed)
+    return re.sub(r"\[.*?\]", "", title).strip()
+
+def prepare_entry(entry: Entry, feed: FeedItem, skip_date: bool = False) -> bool:
+    """
+    Normalizes the titles of an entry, then downloads and cleans it.
+    Returns False if the entry should be skipped.
+    """
+    feed.title = strip_tags(feed.title)
+    entry.title = strip_tags(entry.title)
+    if WANDERING_INN_URL_FRAGMENT in entry.link:
+        entry.entryType = EntryType.wanderinginn
+        entry.title = feed.title + " - " + entry.title
         if entry.ignore():
-            logger.info(f"Ignoring entry after download: {entry.title}")
-            return
-        clean(entry, feed)
-        convert_to_epub(entry, feed)
-        if skip_email_prep:
-            return None
-        return prepare_email(entry, feed)
+            logger.info(f"Ignoring entry: {entry.title}")
+            return False
+        if has_entry(entry):
+            return False
+    if not skip_date:
+        entry.title = entry.get_date() + " - " + entry.title
+    download(entry, feed)
+    if entry.ignore():
+        logger.info(f"Ignoring entry after download: {entry.title}")
+        return False
+    clean(entry, feed)
+    return True
 
-    except Exception as e:
-        logger.exception(f"Error processing entry: {e}")
+def convert_entries_to_epub(entries: List[Entry], feed: FeedItem) -> List[Entry]:
+    """
+    Converts entries to EPUB in parallel on the pandoc workers.
+    Returns the entries that were converted successfully.
+    """
+    def convert(entry: Entry) -> bool:
+        try:
+            convert_to_epub(entry, feed)
+            return True
+        except Exception as e:
+            logger.exception(f"Error converting entry {entry.title}: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=max(1, PANDOC_WORKERS)) as executor:
+        converted = list(executor.map(convert, entries))
+    return [entry for entry, ok in zip(entries, converted) if ok]
+
+def process_entries(entries: List[Entry], feed: FeedItem, skip_email_prep: bool = False, skip_date: bool = False) -> List[EmailBatch]:
+    """
+    Processes the entries of a feed. Downloading and cleaning run one entry at a time,
+    the EPUB conversions then run in parallel.
+    Raises if every entry that was attempted failed, which counts against the feed's health.
+    """
+    prepared = []
+    failed, last_error = 0, None
+    for entry in entries:
+        try:
+            with log_context(entry=entry.link):
+                if prepare_entry(entry, feed, skip_date):
+                    prepared.append(entry)
+        except Exception as e:
+            logger.exception(f"Error processing entry: {e}")
+            failed, last_error = failed + 1, e
+    if failed and not prepared:
+        raise RuntimeError(f"All {failed} entries failed, last error: {last_error}")
+
+    converted = convert_entries_to_epub(prepared, feed)
+    if skip_email_prep:
+        return []
+
+    email_batch = []
+    known = known_chapters() if converted else None
+    for entry in converted:
+        batch = prepare_email(entry, feed, known)
+        if batch:
+            email_batch.append(batch)
+    return email_batch
 
-def create_compiled_ebook(entries: List[Entry], feed: FeedItem):
+def create_compiled_ebook(entries: List[Entry], feed: FeedItem, title: str = "", file_name: str = ""):
     """
-    Creates a single compiled ebook from multiple entries.
+    Creates a single compiled ebook from multiple entries, with a chapter per entry.
+    title and file_name default to the complete book of the feed.
     """
+    title = title or f"{feed.title} - Complete"
+    file_name = file_name or f"{feed.title}_compiled"
     feed_path = os.path.join(DATA_PATH, sanitize_filename(feed.title))
-    compiled_epub_filename = f"{sanitize_filename(feed.title)}_compiled.epub"
+    compiled_epub_filename = f"{sanitize_filename(file_name)}.epub"
     compiled_epub_path = os.path.join(feed_path, compiled_epub_filename)
         
-    logger.info(f"Creating compiled ebook for {feed.title} with {len(entries)} chapters")
+    logger.info(f"Creating compiled ebook {title} with {len(entries)} chapters")
     
     # Create a combined HTML file with chapter titles
     compiled_html_path = os.path.join(feed_path, "compiled_temp.html")
@@ -408,36 +625,31 @@ def create_compiled_ebook(entries: List[Entry], feed: FeedItem):
             
             # Entries should already be in oldest-first order
             for entry in entries:
-                cleaned_html_path = os.path.join(feed_path, "cleaned", f"{sanitize_filename(entry.title)}.html")
-                if os.path.exists(cleaned_html_path):
-                    # Add chapter title as h1 heading
-                    compiled_file.write(f"<h1>{entry.title}</h1>\n")
-                    
-                    # Read and append chapter content
-                    with open(cleaned_html_path, "r") as chapter_file:
-                        chapter_content = chapter_file.read()
-                        compiled_file.write(chapter_content)
-                        compiled_file.write("\n")
+                cleaned_html_path = artifact_paths(entry.title, feed.title)["cleaned"]
+                if not MANIFEST.has(entry.link, "cleaned", cleaned_html_path):
+                    logger.warning(f"Leaving {entry.title} out of {title}, it has no cleaned file")
+                    continue
+                # Add chapter title as h1 heading
+                compiled_file.write(f"<h1>{entry.title}</h1>\n")
+
+                # Read and append chapter content
+                with open(cleaned_html_path, "r") as chapter_file:
+                    chapter_content = chapter_file.read()
+                    compiled_file.write(chapter_content)
+                    compiled_file.write("\n")
             
             compiled_file.write("</body></html>")
         
         # Convert the combined HTML to EPUB
-        compiled_epub_path_no_space = os.path.join(feed_path, f"{feed.title.replace(' ', '_')}_compiled.epub")
-        
-        extra_args = [
-            '--metadata', f'title={feed.title} - Complete',
-            '--metadata', 'lang=en-US',
-            '--css', "./epub.css",
-            '--toc-depth=1',
-            '--epub-title-page=false'
-        ]
+        compiled_epub_path_no_space = os.path.join(feed_path, f"{file_name.replace(' ', '_')}.epub")
         
-        pypandoc.convert_file(
-            compiled_html_path,
-            'epub',
-            outputfile=compiled_epub_path_no_space,
-            extra_args=extra_args
-        )
+        with timed("convert_compiled", feed.name, site_of(feed.url)):
+            convert_html_to_epub(
+                compiled_html_path,
+                compiled_epub_path_no_space,
+                title,
+                toc_depth=1
+            )
         os.rename(compiled_epub_path_no_space, compiled_epub_path)
         
         # Clean up temporary file
@@ -452,98 +664,227 @@ def create_compiled_ebook(entries: List[Entry], feed: FeedItem):
             os.remove(compiled_html_path)
         return None
 
+def digest_enabled(feed: FeedItem) -> bool:
+    return DIGEST_MODE or bool(feed.digest)
+
+def last_scheduled_digest(now: int) -> int:
+    """
+    Returns the most recent DIGEST_SEND_TIME (local time) at or before now,
+    or 0 when digests are only sent by chapter count.
+    """
+    if not DIGEST_SEND_TIME:
+        return 0
+    hour, minute = (int(part) for part in DIGEST_SEND_TIME.split(":"))
+    today = time.localtime(now)
+    scheduled = int(time.mktime((today.tm_year, today.tm_mon, today.tm_mday, hour, minute, 0, 0, 0, -1)))
+    if scheduled > now:
+        scheduled = int(time.mktime((today.tm_year, today.tm_mon, today.tm_mday - 1, hour, minute, 0, 0, 0, -1)))
+    return scheduled
+
+def queue_digest_entries(entries: List[Entry], feed: FeedItem):
+    """
+    Downloads and cleans new entries and queues them for the feed's next digest
+    instead of converting and sending each one.
+    """
+    for entry in entries:
+        try:
+            if has_entry(entry) or in_digest(entry):
+                continue
+            if prepare_entry(entry, feed):
+                add_digest_entry(entry, feed)
+                logger.info(f"Queued {entry.title} for the next digest of {feed.title}")
+        except Exception as e:
+            logger.exception(f"Error processing entry: {e}")
+
+def has_cleaned(entry: Entry, feed: FeedItem) -> bool:
+    return MANIFEST.has(entry.link, "cleaned", artifact_paths(entry.title, feed.title)["cleaned"])
+
+def flush_digest(feed: FeedItem) -> List[EmailBatch]:
+    """
+    Assembles the chapters queued for a feed into one EPUB once DIGEST_MAX_CHAPTERS
+    are queued or DIGEST_SEND_TIME has passed since the last digest.
+    Returns the digest email, or nothing if no digest is due.
+    """
+    now = int(time.time())
+    last_digest = get_last_digest(feed.url)
+    if last_digest == 0:
+        # The first digest of a feed goes out at the next scheduled time, not right away
+        set_last_digest(feed.url, now)
+        last_digest = now
+    entries = get_digest_entries(feed.url)
+    ready = [entry for entry in entries if has_cleaned(entry, feed)]
+    if len(ready) < len(entries):
+        logger.warning(f"{len(entries) - len(ready)} queued chapters of {feed.title} have no cleaned file, leaving them queued")
+    entries = ready
+    if not entries:
+        return []
+    if len(entries) < DIGEST_MAX_CHAPTERS and last_scheduled_digest(now) <= last_digest:
+        return []
+
+    date = time.strftime("%Y-%m-%d", time.localtime(now))
+    epub_path = create_compiled_ebook(
+        entries,
+        feed,
+        title=f"{feed.title} - {date} ({len(entries)} chapters)",
+        file_name=f"{feed.title}_digest_{time.strftime('%Y-%m-%d_%H%M', time.localtime(now))}"
+    )
+    if not epub_path or not os.path.exists(epub_path):
+        return []
+
+    digest_entry = Entry(
+        title=f"{feed.title} - Digest {date} ({len(entries)} chapters)",
+        link=f"{feed.url}#digest-{now}",
+        entryType=entries[0].entryType,
+        published_parsed=tuple(time.localtime(now)),
+    )
+    # The chapters are recorded along with the digest, once its email is delivered
+    mark_digest_assembled(feed.url, [entry.link for entry in entries], digest_entry.link)
+    set_last_digest(feed.url, now)
+    logger.info(f"Assembled digest of {len(entries)} chapters for {feed.title}")
+    return [EmailBatch(entry=digest_entry, feed=feed, epub_path=epub_path, chapters=entries)]
+
+def feed_allowed(feed: FeedItem, now: int) -> bool:
+    """
+    Circuit breaker for a feed. A feed that failed FEED_FAILURE_THRESHOLD runs in a row
+    is skipped until its cool-down is over, then probed with a single run: success closes
+    the breaker, another failure doubles the cool-down.
+    """
+    return not feed.failures or feed.failures < FEED_FAILURE_THRESHOLD or now >= feed.next_attempt
+
+def record_feed_result(feed: FeedItem, url: str, error: Exception | None):
+    """
+    Stores the outcome of a feed run in the feeds table.
+    """
+    if error is None:
+        if feed.failures:
+            logger.info(f"Feed {feed.name} recovered after {feed.failures} failed runs")
+            update_feed(url, {"failures": 0, "last_error": "", "next_attempt": 0})
+        return
+
+    failures = (feed.failures or 0) + 1
+    next_attempt = 0
+    if failures >= FEED_FAILURE_THRESHOLD:
+        cooldown = min(FEED_COOLDOWN_BASE_SECONDS * 2 ** (failures - FEED_FAILURE_THRESHOLD), FEED_COOLDOWN_MAX_SECONDS)
+        next_attempt = int(time.time()) + cooldown
+        logger.warning(f"Feed {feed.name} failed {failures} runs in a row, pausing it for {cooldown}s")
+    update_feed(url, {"failures": failures, "last_error": str(error)[:500], "next_attempt": next_attempt})
+
 def process_feed_item(feed: FeedItem):
     """
     Processes a single feed item.
     """
-    email_batch = []
+    if feed.ignore:
+        logger.debug(f"Ignoring feed: {feed.name}")
+        return []
+    if not feed_allowed(feed, int(time.time())):
+        logger.info(f"Skipping feed {feed.name} until {time.ctime(feed.next_attempt)} after {feed.failures} failed runs")
+        return []
+
+    # The feeds table is keyed by the url as stored, before normalization
+    stored_url = feed.url
     try:
-        if feed.ignore:
-            logger.debug(f"Ignoring feed: {feed.name}")
-            return email_batch
-
-        logger.debug(f"Processing feed - {feed.name}")
-        feed.url = normalize_royal_road_url(feed.url)
-        feed_data = feedparser.parse(feed.url)
-        feed.title = feed_data.feed.get("title", "")
-        entries = feed_data.get("entries", [])
+        email_batch = _process_feed_item(feed)
+    except Exception as e:
+        logger.exception(f"Error processing feed {feed.name}: {e}")
+        STAGE_ERRORS.inc(stage="feed", feed=feed.name, site=site_of(feed.url))
+        record_feed_result(feed, stored_url, e)
+        return []
+    record_feed_result(feed, stored_url, None)
+    return email_batch
+
+def _process_feed_item(feed: FeedItem) -> List[EmailBatch]:
+    """
+    Fetches a feed and processes its new entries. Raises if the run failed.
+    """
+    email_batch = []
+    logger.debug(f"Processing feed - {feed.name}")
+    feed.url = normalize_royal_road_url(feed.url)
+    with timed("feed_fetch", feed.name, site_of(feed.url)):
+        feed_data = read_feed(feed.url, lambda entry: has_entry(Entry(**entry))) if FAST_FEED_PARSER else None
+        if feed_data is None:
+            import feedparser
+            feed_data = feedparser.parse(feed.url)
+    if feed_data.get("bozo") and not feed_data.get("entries"):
+        raise ValueError(f"Could not read feed: {feed_data.get('bozo_exception')}")
+    remember_feed(feed.url, feed_data)
+    # Normalized before any branch, artifact paths are built from the stripped title
+    feed.title = strip_tags(feed_data.feed.get("title", ""))
+    entries = feed_data.get("entries", [])
         
-        # Check how many unprocessed entries there are
-        unprocessed_entries = []
-        for entry in entries:
-            try:
-                entry = Entry(**entry)
-                if not has_entry(entry):
-                    unprocessed_entries.append(entry)
-            except Exception as e:
-                logger.exception(f"Error checking entry: {e}")
+    # Check how many unprocessed entries there are
+    digest = digest_enabled(feed)
+    unprocessed_entries = []
+    for entry in entries:
+        try:
+            entry = Entry(**entry)
+            if not has_entry(entry) and not (digest and in_digest(entry)):
+                unprocessed_entries.append(entry)
+        except Exception as e:
+            logger.exception(f"Error checking entry: {e}")
+    known = known_chapters()
+    unprocessed_entries = drop_duplicates(unprocessed_entries, feed, known)
         
-        # Special logic for new books with many unprocessed entries
-        if len(unprocessed_entries) > ENTRY_THRESHOLD_FOR_NEW_BOOK:
-            logger.info(f"Detected new book with {len(unprocessed_entries)} unprocessed entries (>{ENTRY_THRESHOLD_FOR_NEW_BOOK}). Creating compiled ebook.")
+    # Special logic for new books with many unprocessed entries
+    if len(unprocessed_entries) > ENTRY_THRESHOLD_FOR_NEW_BOOK:
+        logger.info(f"Detected new book with {len(unprocessed_entries)} unprocessed entries (>{ENTRY_THRESHOLD_FOR_NEW_BOOK}). Creating compiled ebook.")
             
-            # Store original RSS feed entries before potentially replacing them
-            original_rss_entries = unprocessed_entries.copy()
+        # Store original RSS feed entries before potentially replacing them
+        original_rss_entries = unprocessed_entries.copy()
             
-            # For Royal Road books, scrape the table of contents to get all chapters
-            if "royalroad.com" in feed.url:
-                logger.info("Royal Road feed detected. Scraping table of contents for complete book.")
-                all_chapters = get_royal_road_chapters(feed.url)
-                if all_chapters:
-                    # Filter to only unprocessed chapters and reverse to get oldest first
-                    unprocessed_entries = [entry for entry in all_chapters if not has_entry(entry)]
-                    logger.info(f"Found {len(unprocessed_entries)} unprocessed chapters from Royal Road TOC")
+        # For Royal Road books, scrape the table of contents to get all chapters
+        if "royalroad.com" in feed.url:
+            logger.info("Royal Road feed detected. Scraping table of contents for complete book.")
+            toc_entries = get_royal_road_chapters(feed.url, [entry.link for entry in original_rss_entries])
+            if toc_entries is not None:
+                unprocessed_entries = drop_duplicates(toc_entries, feed, known)
+                logger.info(f"Found {len(unprocessed_entries)} unprocessed chapters from Royal Road TOC")
                     
-                    # If TOC has no unprocessed entries, mark original RSS entries as processed to avoid reprocessing
-                    if len(unprocessed_entries) == 0:
-                        logger.info("No unprocessed chapters from TOC. Marking original RSS entries as processed.")
-                        for entry in original_rss_entries:
-                            entry.time_sent = int(time.time())
-                            add_entry(entry, feed)
-                        return email_batch
+                # If TOC has no unprocessed entries, mark original RSS entries as processed to avoid reprocessing
+                if len(unprocessed_entries) == 0:
+                    logger.info("No unprocessed chapters from TOC. Marking original RSS entries as processed.")
+                    for entry in original_rss_entries:
+                        entry.time_sent = int(time.time())
+                        add_entry(entry, feed)
+                    return email_batch
             
-            # Process all entries without preparing individual emails
-            processed_entries = []
-            for entry in unprocessed_entries:
-                try:
-                    process_entry(entry, feed, skip_email_prep=True, skip_date=True)
-                    processed_entries.append(entry)
-                except Exception as e:
-                    logger.exception(f"Error processing entry: {e}")
+        # Process all entries without preparing individual emails
+        process_entries(unprocessed_entries, feed, skip_email_prep=True, skip_date=True)
+        processed_entries = unprocessed_entries
             
-            # Create compiled ebook
-            compiled_epub_path = create_compiled_ebook(processed_entries, feed)
+        # Create compiled ebook
+        compiled_epub_path = create_compiled_ebook(processed_entries, feed)
             
-            if compiled_epub_path and os.path.exists(compiled_epub_path):
-                # Create a single email batch for the compiled ebook
-                # Use the first entry as representative
-                if processed_entries:
-                    representative_entry = processed_entries[0]
-                    representative_entry.title = f"{feed.title} - Complete ({len(processed_entries)} chapters)"
-                    email_batch.append(EmailBatch(
-                        entry=representative_entry,
-                        feed=feed,
-                        epub_path=compiled_epub_path
-                    ))
+        if compiled_epub_path and os.path.exists(compiled_epub_path):
+            # Create a single email batch for the compiled ebook
+            # Use the first entry as representative
+            if processed_entries:
+                representative_entry = processed_entries[0]
+                representative_entry.title = f"{feed.title} - Complete ({len(processed_entries)} chapters)"
+                email_batch.append(EmailBatch(
+                    entry=representative_entry,
+                    feed=feed,
+                    epub_path=compiled_epub_path
+                ))
             
-            # Mark all entries as processed regardless of email batch creation
-            # This prevents treating it as a new book on next run
-            for entry in processed_entries:
-                entry.time_sent = int(time.time())
-                add_entry(entry, feed)
-            logger.info(f"Marked {len(processed_entries)} chapters as processed")
-        else:
-            # Normal processing for regular updates
-            for entry in entries:
-                try:
-                    entry = Entry(**entry)
-                    batch = process_entry(entry, feed)
-                    if batch:
-                        email_batch.append(batch)
-                except Exception as e:
-                    logger.exception(f"Error processing entry: {e}")
-    except Exception as e:
-        logger.exception(f"Error processing feed {feed.name}: {e}")
+        # Mark all entries as processed regardless of email batch creation
+        # This prevents treating it as a new book on next run
+        for entry in processed_entries:
+            entry.time_sent = int(time.time())
+            add_entry(entry, feed)
+        logger.info(f"Marked {len(processed_entries)} chapters as processed")
+    elif digest:
+        queue_digest_entries(unprocessed_entries, feed)
+        email_batch.extend(flush_digest(feed))
+    else:
+        # Normal processing for regular updates
+        feed_entries = []
+        for entry in entries:
+            try:
+                feed_entries.append(Entry(**entry))
+            except Exception as e:
+                logger.exception(f"Error processing entry: {e}")
+        feed_entries = [entry for entry in feed_entries if not known.duplicate_for(feed, entry.link)]
+        email_batch.extend(process_entries(feed_entries, feed))
     return email_batch
 
 def process_feed(feed: Feed):
@@ -554,12 +895,62 @@ def process_feed(feed: Feed):
         feed.feeds = feed.feeds[:2]
         feed.dry_run = True
     all_email_batches = []
-    for feed_item in feed.feeds:
-        if feed.dry_run:
-            feed_item.dry_run = feed.dry_run
-        email_batches = process_feed_item(feed_item)
-        all_email_batches.extend(email_batches)
-    send_batch_emails(all_email_batches, feed)
+    # Feeds stay leased until their emails are staged, so no other replica processes them meanwhile
+    with LeaseSet() as leases:
+        for feed_item in feed.feeds:
+            if feed.dry_run:
+                feed_item.dry_run = feed.dry_run
+            lease_key = f"feed:{feed_item.url}"
+            if not leases.claim(lease_key):
+                logger.info(f"Skipping feed {feed_item.name}, another worker is processing it")
+                continue
+            with log_context(feed=feed_item.name):
+                email_batches = process_feed_item(feed_item)
+            # A lease lost during the run may already belong to another worker
+            if not leases.holds(lease_key):
+                logger.warning(f"Dropping the emails of {feed_item.name}, its lease expired")
+                continue
+            all_email_batches.extend(email_batches)
+        send_batch_emails(all_email_batches, feed)
+
+def recheck_patreon_entries(rechecks: List[tuple[Entry, FeedItem]]):
+    """
+    Downloads entries again whose patreon lock expired, and sends the ones that are
+    no longer locked, or queues them for the digest of digest feeds. Entries that are
+    still locked are queued again by download.
+    """
+    with PIPELINE_LOCK:
+        email_batch = []
+        for entry, feed in rechecks:
+            try:
+                # Sent by a feed cycle in the meantime
+                if has_entry(entry):
+                    continue
+                entry.patreon_lock = 0
+                download(entry, feed)
+                if entry.ignore():
+                    logger.info(f"Entry {entry.title} is still patreon-locked")
+                    continue
+                clean(entry, feed)
+                if digest_enabled(feed):
+                    if add_digest_entry(entry, feed):
+                        logger.info(f"Queued unlocked {entry.title} for the next digest of {feed.title}")
+                    continue
+                convert_to_epub(entry, feed)
+                batch = prepare_email(entry, feed)
+                if batch:
+                    email_batch.append(batch)
+            except Exception as e:
+                logger.exception(f"Error rechecking entry {entry.title}: {e}")
+        send_batch_emails(email_batch, Feed(feeds=[], dry_run=DEBUG_MODE))
+
+def run_exclusive(func, *args, **kwargs):
+    """
+    Runs func while no feed cycle or patreon recheck is writing entries and files,
+    waiting for a running one to finish.
+    """
+    with PIPELINE_LOCK:
+        return func(*args, **kwargs)
 
 def execute():
     # check to see if file system is mounted
@@ -568,8 +959,10 @@ def execute():
         logger.error(f"Test file not found: {test_file}")
         return
     logger.info("Feed processing started.")
-    feed = get_feed_list()
-    process_feed(feed)
+    with PIPELINE_LOCK, timed("cycle"), log_context(run_id=uuid.uuid4().hex[:12]):
+        MANIFEST.reconcile_if_empty()
+        feed = get_feed_list()
+        process_feed(feed)
 
 if __name__ == "__main__":
     import csv
@@ -600,11 +993,7 @@ if __name__ == "__main__":
     )
     
     # Process all entries (skip email prep since we want compiled output)
-    for entry in entries:
-        try:
-            process_entry(entry, feed_item, skip_email_prep=True, skip_date=True)
-        except Exception as e:
-            logger.exception(f"Error processing entry: {e}")
+    process_entries(entries, feed_item, skip_email_prep=True, skip_date=True)
     
     # Create compiled ebook
     compiled_epub_path = create_compiled_ebook(entries, feed_item)
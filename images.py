@@ -0,0 +1,156 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+from utils import custom_logger
+
+DATA_PATH = os.getenv("DATA_PATH", "/data")
+EMBED_IMAGES = os.getenv("EMBED_IMAGES", "false") == "true"
+IMAGE_CACHE_PATH = os.path.join(DATA_PATH, "images")
+IMAGE_FETCH_WORKERS = int(os.getenv("IMAGE_FETCH_WORKERS", "4"))
+IMAGE_FETCH_TIMEOUT_SECONDS = int(os.getenv("IMAGE_FETCH_TIMEOUT_SECONDS", "30"))
+# Kindle Paperwhite screen, larger images are only scaled down again on the device
+IMAGE_MAX_WIDTH = int(os.getenv("IMAGE_MAX_WIDTH", "1072"))
+IMAGE_MAX_HEIGHT = int(os.getenv("IMAGE_MAX_HEIGHT", "1448"))
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", 150 * 1024))
+IMAGE_MIN_QUALITY = 30
+logger = custom_logger(__name__)
+
+_index_lock = threading.Lock()
+
+
+def _index_path() -> str:
+    return os.path.join(IMAGE_CACHE_PATH, "index.json")
+
+
+def _load_index() -> dict:
+    try:
+        with open(_index_path(), "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def _remember(url: str, file_name: str):
+    with _index_lock:
+        index = _load_index()
+        index[url] = file_name
+        with open(_index_path() + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(_index_path() + ".tmp", _index_path())
+
+
+def shrink_image(data: bytes, max_bytes: int = IMAGE_MAX_BYTES) -> bytes:
+    """
+    Converts an image to a grayscale JPEG that fits the e-reader screen,
+    lowering the quality and then the size until it is under max_bytes.
+    """
+    from PIL import Image, ImageOps
+
+    image = Image.open(io.BytesIO(data))
+    image = ImageOps.exif_transpose(image).convert("L")
+    image.thumbnail((IMAGE_MAX_WIDTH, IMAGE_MAX_HEIGHT))
+    while True:
+        for quality in range(80, IMAGE_MIN_QUALITY - 1, -10):
+            output = io.BytesIO()
+            image.save(output, "JPEG", quality=quality, optimize=True, progressive=True)
+            if output.tell() <= max_bytes:
+                return output.getvalue()
+        if min(image.size) < 64:
+            return output.getvalue()
+        image = image.resize((int(image.width * 0.75), int(image.height * 0.75)))
+
+
+def fetch_image(url: str) -> str | None:
+    """
+    Returns the path of the processed copy of an image, downloading and shrinking it
+    if it isn't cached yet. Files are named by the hash of the original image, so the
+    same picture linked from several chapters or urls is stored once.
+    """
+    import requests
+
+    cached = _load_index().get(url)
+    if cached and os.path.exists(os.path.join(IMAGE_CACHE_PATH, cached)):
+        return os.path.join(IMAGE_CACHE_PATH, cached)
+    try:
+        response = requests.get(url, timeout=IMAGE_FETCH_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        file_name = hashlib.sha256(response.content).hexdigest()[:32] + ".jpg"
+        file_path = os.path.join(IMAGE_CACHE_PATH, file_name)
+        if not os.path.exists(file_path):
+            processed = shrink_image(response.content)
+            temp_path = f"{file_path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(processed)
+            os.replace(temp_path, file_path)
+            logger.info(f"Cached image {url} ({len(response.content)} -> {len(processed)} bytes)")
+        _remember(url, file_name)
+        return file_path
+    except Exception as e:
+        logger.warning(f"Could not embed image {url}: {e}")
+        return None
+
+
+def _fetch_sources(images: list, page_url: str) -> tuple:
+    """
+    Fetches the images of img elements concurrently.
+    Returns [(img, url)] and {url: local path or None}.
+    """
+    os.makedirs(IMAGE_CACHE_PATH, exist_ok=True)
+    sources = []
+    for img in images:
+        # WordPress lazy loading keeps the real source in data-src
+        src = img.get("data-src") or img.get("src")
+        sources.append((img, urljoin(page_url, src) if src else None))
+
+    unique_urls = sorted({url for _, url in sources if url})
+    with ThreadPoolExecutor(max_workers=IMAGE_FETCH_WORKERS) as executor:
+        paths = dict(zip(unique_urls, executor.map(fetch_image, unique_urls)))
+    return sources, paths
+
+
+def embed_images(element, page_url: str):
+    """
+    Points every img in a BeautifulSoup element at a local, shrunk copy of its image,
+    fetching the images concurrently. Images that can't be fetched are removed.
+    """
+    images = element.find_all("img")
+    if not images:
+        return
+    sources, paths = _fetch_sources(images, page_url)
+
+    for img, url in sources:
+        path = paths.get(url)
+        if not path:
+            img.decompose()
+            continue
+        img.attrs = {"src": path, "alt": img.get("alt", "")}
+        # Links around images point to the full size original
+        if img.parent is not None and img.parent.name == "a":
+            img.parent.unwrap()
+
+
+def embed_images_tree(element, page_url: str):
+    """
+    embed_images for an lxml.html element.
+    """
+    images = list(element.iter("img"))
+    if not images:
+        return
+    sources, paths = _fetch_sources(images, page_url)
+
+    for img, url in sources:
+        path = paths.get(url)
+        if not path:
+            img.drop_tree()
+            continue
+        alt = img.get("alt", "")
+        img.attrib.clear()
+        img.set("src", path)
+        img.set("alt", alt)
+        parent = img.getparent()
+        if parent is not None and parent.tag == "a":
+            parent.drop_tag()
@@ -0,0 +1,219 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable
+from utils import custom_logger
+
+CONFIG_PATH = os.getenv("CONFIG_PATH", "/config")
+# "local" only coordinates within this process, "sqlite" across every replica sharing LEASE_PATH
+LEASE_BACKEND = os.getenv("LEASE_BACKEND", "local")
+LEASE_PATH = os.getenv("LEASE_PATH", os.path.join(CONFIG_PATH, "leases.sqlite"))
+LEASE_TTL_SECONDS = int(os.getenv("LEASE_TTL_SECONDS", "300"))
+WORKER_ID = os.getenv("WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")
+logger = custom_logger(__name__)
+
+
+class LeaseBackend(ABC):
+    """
+    Where leases are kept. A lease on a key belongs to one owner until it expires
+    or is released; claim must be atomic across every worker using the backend.
+    """
+    @abstractmethod
+    def claim(self, key: str, owner: str, ttl: int) -> bool:
+        ...
+
+    @abstractmethod
+    def renew(self, keys: list[str], owner: str, ttl: int) -> list[str]:
+        """
+        Extends the leases owner still holds, returns their keys.
+        """
+
+    @abstractmethod
+    def release(self, keys: list[str], owner: str):
+        ...
+
+    @abstractmethod
+    def all(self) -> list[dict]:
+        ...
+
+
+class LocalLeaseBackend(LeaseBackend):
+    """
+    Leases in memory, for a single instance.
+    """
+    def __init__(self):
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key: str, owner: str, ttl: int) -> bool:
+        now = time.time()
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease and lease["owner"] != owner and lease["expires_at"] > now:
+                return False
+            self._leases[key] = {"key": key, "owner": owner, "expires_at": now + ttl, "heartbeat_at": now}
+            return True
+
+    def renew(self, keys: list[str], owner: str, ttl: int) -> list[str]:
+        now = time.time()
+        held = []
+        with self._lock:
+            for key in keys:
+                lease = self._leases.get(key)
+                if lease and lease["owner"] == owner:
+                    lease.update(expires_at=now + ttl, heartbeat_at=now)
+                    held.append(key)
+        return held
+
+    def release(self, keys: list[str], owner: str):
+        with self._lock:
+            for key in keys:
+                if self._leases.get(key, {}).get("owner") == owner:
+                    del self._leases[key]
+
+    def all(self) -> list[dict]:
+        with self._lock:
+            return [dict(lease) for lease in self._leases.values()]
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    """
+    Leases in an SQLite file. Every statement runs in its own write transaction,
+    so replicas on one host or on a volume with working file locks can share it.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                "key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL, heartbeat_at REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def claim(self, key: str, owner: str, ttl: int) -> bool:
+        now = time.time()
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "INSERT INTO leases (key, owner, expires_at, heartbeat_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at, "
+                "heartbeat_at = excluded.heartbeat_at WHERE leases.owner = excluded.owner OR leases.expires_at <= ?",
+                (key, owner, now + ttl, now, now),
+            )
+            return cursor.rowcount == 1
+
+    def renew(self, keys: list[str], owner: str, ttl: int) -> list[str]:
+        now = time.time()
+        held = []
+        with self._connect() as connection:
+            for key in keys:
+                cursor = connection.execute(
+                    "UPDATE leases SET expires_at = ?, heartbeat_at = ? WHERE key = ? AND owner = ?",
+                    (now + ttl, now, key, owner),
+                )
+                if cursor.rowcount:
+                    held.append(key)
+        return held
+
+    def release(self, keys: list[str], owner: str):
+        with self._connect() as connection:
+            connection.executemany("DELETE FROM leases WHERE key = ? AND owner = ?", [(key, owner) for key in keys])
+
+    def all(self) -> list[dict]:
+        with self._connect() as connection:
+            rows = connection.execute("SELECT key, owner, expires_at, heartbeat_at FROM leases ORDER BY key").fetchall()
+        return [dict(zip(("key", "owner", "expires_at", "heartbeat_at"), row)) for row in rows]
+
+
+LEASE_BACKENDS: dict[str, Callable[[], LeaseBackend]] = {
+    "local": LocalLeaseBackend,
+    "sqlite": lambda: SQLiteLeaseBackend(LEASE_PATH),
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def register_lease_backend(name: str, factory: Callable[[], LeaseBackend]):
+    """
+    Makes another backend available as LEASE_BACKEND=name.
+    """
+    LEASE_BACKENDS[name] = factory
+
+
+def get_lease_backend() -> LeaseBackend:
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if LEASE_BACKEND not in LEASE_BACKENDS:
+                raise ValueError(f"Unknown LEASE_BACKEND {LEASE_BACKEND}, expected one of {', '.join(LEASE_BACKENDS)}")
+            _backend = LEASE_BACKENDS[LEASE_BACKEND]()
+        return _backend
+
+
+class LeaseSet:
+    """
+    The leases a worker holds for one piece of work. A background heartbeat renews them
+    every third of the ttl, and leaving the with block releases them. Leases of a worker
+    that crashed expire after ttl seconds, and their work is claimed by the next worker.
+    """
+    def __init__(self, backend: LeaseBackend | None = None, owner: str = WORKER_ID, ttl: int = LEASE_TTL_SECONDS):
+        self.backend = backend or get_lease_backend()
+        self.owner = owner
+        self.ttl = ttl
+        self._held = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat, name="lease-heartbeat", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stopped.set()
+        self._thread.join(timeout=5)
+        with self._lock:
+            held, self._held = list(self._held), set()
+        if held:
+            self.backend.release(held, self.owner)
+
+    def claim(self, key: str) -> bool:
+        if not self.backend.claim(key, self.owner, self.ttl):
+            return False
+        with self._lock:
+            self._held.add(key)
+        return True
+
+    def holds(self, key: str) -> bool:
+        with self._lock:
+            return key in self._held
+
+    def _heartbeat(self):
+        while not self._stopped.wait(max(1, self.ttl / 3)):
+            with self._lock:
+                keys = list(self._held)
+            if not keys:
+                continue
+            try:
+                held = set(self.backend.renew(keys, self.owner, self.ttl))
+            except Exception as e:
+                logger.exception(f"Could not renew leases: {e}")
+                continue
+            lost = set(keys) - held
+            if lost:
+                logger.warning(f"Lost leases {', '.join(sorted(lost))}, another worker may take over")
+                with self._lock:
+                    self._held -= lost
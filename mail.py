@@ -1,7 +1,9 @@
+import base64
 import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.application import MIMEApplication
+import socket
+import uuid
+from email.header import Header
+from email.utils import encode_rfc2231, formatdate, make_msgid
 import os
 from utils import custom_logger
 
@@ -10,6 +12,154 @@ logger = custom_logger(__name__)
 SENDER_EMAIL = os.getenv("SENDER_EMAIL", "")
 APP_PASSWORD = os.getenv("APP_PASSWORD", "")
 TO_EMAIL = os.getenv("TO_EMAIL", "")
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465"))
+SMTP_SSL = os.getenv("SMTP_SSL", "true") == "true"
+# Gmail rejects messages over 25MB, counted after base64 encoding
+MAX_EMAIL_BYTES = int(os.getenv("MAX_EMAIL_BYTES", 25 * 1024 * 1024))
+# A multiple of 57 bytes, so every chunk encodes to complete 76 character base64 lines
+ATTACHMENT_CHUNK_BYTES = 57 * 1024
+
+def _encode_header(value: str) -> str:
+    if value.isascii():
+        return value
+    return Header(value, "utf-8").encode(linesep="\r\n")
+
+def _filename_param(filename: str) -> str:
+    if filename.isascii():
+        return 'filename="{}"'.format(filename.replace("\\", "\\\\").replace('"', '\\"'))
+    return f"filename*={encode_rfc2231(filename, 'utf-8')}"
+
+def _base64_size(size: int) -> int:
+    # 76 characters plus CRLF for every 57 input bytes
+    return (size + 56) // 57 * 78
+
+def _encode_base64(data: bytes) -> bytes:
+    return base64.encodebytes(data).replace(b"\n", b"\r\n")
+
+def build_message(subject: str, content: str, attachment_path: str, sender_email: str, to_email: str) -> tuple[bytes, bytes, int]:
+    """
+    Builds a multipart message around an attachment without reading the attachment.
+    Returns the bytes before and after the attachment's base64 body, and the total size.
+    Every part is base64 encoded, so no line of the message needs dot-stuffing.
+    """
+    boundary = f"=============={uuid.uuid4().hex}=="
+    lines = [
+        f"From: {sender_email}",
+        f"To: {to_email}",
+        f"Subject: {_encode_header(subject)}",
+        f"Date: {formatdate(localtime=True)}",
+        f"Message-ID: {make_msgid()}",
+        "MIME-Version: 1.0",
+        f'Content-Type: multipart/mixed; boundary="{boundary}"',
+        "",
+        f"--{boundary}",
+        'Content-Type: text/plain; charset="utf-8"',
+        "MIME-Version: 1.0",
+        "Content-Transfer-Encoding: base64",
+        "",
+    ]
+    head = "\r\n".join(lines).encode("ascii") + b"\r\n" + _encode_base64(content.encode("utf-8"))
+    tail = f"--{boundary}--\r\n".encode("ascii")
+    attachment_size = 0
+    if attachment_path:
+        filename = os.path.basename(attachment_path)
+        subtype = os.path.splitext(attachment_path)[1][1:] or "octet-stream"
+        attachment_lines = [
+            f"--{boundary}",
+            f"Content-Type: application/{subtype}",
+            "MIME-Version: 1.0",
+            "Content-Transfer-Encoding: base64",
+            f"Content-Disposition: attachment; {_filename_param(filename)}",
+            "",
+        ]
+        head += "\r\n".join(attachment_lines).encode("utf-8") + b"\r\n"
+        attachment_size = _base64_size(os.path.getsize(attachment_path))
+    return head, tail, len(head) + attachment_size + len(tail)
+
+class SMTPSession:
+    """
+    A logged-in SMTP connection that sends any number of messages, so a batch of
+    emails pays for the connection, TLS handshake and login once. Connects on the
+    first send and reconnects on the next send after a failure.
+    """
+    def __init__(self, sender_email: str = SENDER_EMAIL, app_password: str = APP_PASSWORD):
+        self.sender_email = sender_email
+        self.app_password = app_password
+        self.server = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def open(self):
+        # Connect to Gmail SMTP server (or the configured stand-in)
+        smtp_class = smtplib.SMTP_SSL if SMTP_SSL else smtplib.SMTP
+        self.server = smtp_class(SMTP_HOST, SMTP_PORT)
+        try:
+            self.server.login(self.sender_email, self.app_password)
+            # Messages go out in several writes, don't let Nagle hold back the last one
+            self.server.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except Exception:
+            self.server.close()
+        self.server = None
+
+    def send(self, subject: str, content: str, attachment_path: str, to_email: str):
+        """
+        Sends one message, streaming the attachment. Raises on failure, after which
+        the connection is dropped since its state is unknown.
+        """
+        if attachment_path and not os.path.exists(attachment_path):
+            raise FileNotFoundError(f"Attachment file not found: {attachment_path}")
+
+        head, tail, message_size = build_message(subject, content, attachment_path, self.sender_email, to_email)
+        if message_size > MAX_EMAIL_BYTES:
+            raise ValueError(f"Message is {message_size} bytes, over the {MAX_EMAIL_BYTES} byte limit")
+
+        if self.server is None:
+            self.open()
+        server = self.server
+        try:
+            options = []
+            if server.has_extn("size"):
+                server_limit = int(server.esmtp_features["size"] or 0)
+                if server_limit and message_size > server_limit:
+                    raise ValueError(f"Message is {message_size} bytes, server accepts {server_limit}")
+                options.append(f"SIZE={message_size}")
+
+            code, response = server.mail(self.sender_email, options)
+            if code != 250:
+                raise smtplib.SMTPSenderRefused(code, response, self.sender_email)
+            code, response = server.rcpt(to_email)
+            if code not in (250, 251):
+                raise smtplib.SMTPRecipientsRefused({to_email: (code, response)})
+            code, response = server.docmd("data")
+            if code != 354:
+                raise smtplib.SMTPDataError(code, response)
+
+            server.send(head)
+            if attachment_path:
+                with open(attachment_path, "rb") as f:
+                    while chunk := f.read(ATTACHMENT_CHUNK_BYTES):
+                        server.send(_encode_base64(chunk))
+            server.send(tail + b".\r\n")
+            code, response = server.getreply()
+            if code != 250:
+                raise smtplib.SMTPDataError(code, response)
+        except Exception:
+            self.close()
+            raise
 
 def send_gmail(
     subject: str = "",
@@ -21,6 +171,9 @@ def send_gmail(
 ) -> bool:
     """
     Send an email with optional attachment using Gmail SMTP server.
+    The attachment is base64 encoded in chunks while it is written to the SMTP
+    connection, so memory use doesn't grow with the size of the file.
+    To send several emails over one connection, use SMTPSession.
     
     Args:
         sender_email (str): Your Gmail address
@@ -32,40 +185,10 @@ def send_gmail(
         
     Returns:
         bool: True if email was sent successfully, False otherwise
-        
-    Raises:
-        FileNotFoundError: If attachment file doesn't exist
-        smtplib.SMTPException: If email sending fails
     """
     try:
-        # Create message container
-        msg = MIMEMultipart()
-        msg['From'] = sender_email
-        msg['To'] = to_email
-        msg['Subject'] = subject
-
-        # Add body
-        msg.attach(MIMEText(content, 'plain'))
-
-        # Add attachment if provided
-        if attachment_path:
-            if not os.path.exists(attachment_path):
-                raise FileNotFoundError(f"Attachment file not found: {attachment_path}")
-            
-            with open(attachment_path, 'rb') as f:
-                attachment = MIMEApplication(f.read(), _subtype=os.path.splitext(attachment_path)[1][1:])
-                attachment.add_header(
-                    'Content-Disposition', 
-                    'attachment', 
-                    filename=os.path.basename(attachment_path)
-                )
-                msg.attach(attachment)
-
-        # Connect to Gmail SMTP server
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-            server.login(sender_email, app_password)
-            server.send_message(msg)
-            
+        with SMTPSession(sender_email, app_password) as session:
+            session.send(subject, content, attachment_path, to_email)
         return True
 
     except Exception as e:
@@ -1,17 +1,25 @@
 import logging
 import os
 import re
-from db import get_entries, get_all_feeds, add_feed, update_feed, delete_feed, migrate_feeds_from_json
+from db import (
+    init_db, get_entries, get_all_feeds, add_feed, update_feed, delete_feed, migrate_feeds_from_json,
+    get_outbox, retry_failed_outbox, get_all_subscribers, add_subscriber, update_subscriber, delete_subscriber
+)
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, FileResponse
 from datetime import datetime
 from utils import custom_logger
-import uvicorn
-from feeder import execute, normalize_royal_road_url
+from feeder import execute, load_keywords, normalize_royal_road_url, recheck_patreon_entries, run_exclusive
 import asyncio
 from fastapi.templating import Jinja2Templates
-from models import FeedItem
-import feedparser
+from models import FeedItem, Subscriber
+from feed_cache import fetch_feed_title
+from metrics import render_metrics
+from profiler import PROFILE_EXECUTE, run_profiled, list_profiles, profile_summary, profile_file
+from recheck import start_recheck_scheduler, stop_recheck_scheduler
+from artifacts import MANIFEST
+from leases import get_lease_backend
+from search import search, reindex, remove_chapter
 
 app = FastAPI()
 logger = custom_logger(__name__)
@@ -33,7 +41,10 @@ async def run_periodic_updates():
 
 
 async def _execute_task():
-    await asyncio.to_thread(execute)
+    if PROFILE_EXECUTE:
+        await asyncio.to_thread(run_profiled, execute)
+    else:
+        await asyncio.to_thread(execute)
 
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
@@ -52,11 +63,51 @@ async def get_status():
     timestamp = now.isoformat() + "Z"
     return timestamp
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Returns per-stage timings and error counts in the Prometheus text format.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.post("/execute")
-async def _execute():
+async def _execute(profile: bool = False):
+    """
+    Runs a feed processing cycle, under cProfile when profile=true or PROFILE_EXECUTE is set.
+    """
+    if profile or PROFILE_EXECUTE:
+        run_id = run_profiled(execute)
+        return {"status": "ok", "run_id": run_id}
     execute()
     return "ok"
 
+@app.get("/profiles")
+async def get_profiles():
+    """
+    Returns the run IDs of the stored execute profiles, newest first.
+    """
+    return {"success": True, "run_ids": list_profiles()}
+
+@app.get("/profiles/{run_id}")
+async def get_profile_summary(run_id: str, limit: int = 30):
+    """
+    Returns the top functions by cumulative time for a profiled run.
+    """
+    summary = profile_summary(run_id, limit)
+    if summary is None:
+        return {"success": False, "message": "Profile not found"}
+    return {"success": True, **summary}
+
+@app.get("/profiles/{run_id}/download")
+async def download_profile(run_id: str):
+    """
+    Returns the raw cProfile dump of a run, readable with pstats or snakeviz.
+    """
+    path = profile_file(run_id)
+    if path is None:
+        return {"success": False, "message": "Profile not found"}
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{run_id}.prof")
+
 @app.get("/sent_items")
 async def get_sent_items():
     """
@@ -95,8 +146,11 @@ async def revert_entry(link: str):
         deleted_files = delete_entry_files(
             entry_to_delete.title,
             feed_title,
-            data_path
+            data_path,
+            MANIFEST.paths(link)
         )
+        MANIFEST.forget(link)
+        remove_chapter(link)
         
         logger.info(f"Reverted entry: {entry_to_delete.title} (deleted {deleted_files} files)")
         return {
@@ -109,6 +163,149 @@ async def revert_entry(link: str):
         return {"success": False, "message": "Failed to delete entry from database"}
 
 
+@app.post("/api/artifacts/reconcile")
+async def api_reconcile_artifacts():
+    """
+    Rebuilds the artifact manifest from the files in DATA_PATH, after a running cycle.
+    """
+    counts = await asyncio.to_thread(run_exclusive, MANIFEST.reconcile)
+    return {
+        "success": True,
+        "message": f"Recorded {counts['recorded']} files, dropped {counts['dropped']}, {counts['unmatched']} unmatched",
+        **counts
+    }
+
+
+# ============== Search Endpoints ==============
+
+@app.get("/api/search")
+async def api_search(q: str, limit: int = 20):
+    """
+    Returns the cleaned chapters of every feed matching q, best match first, with snippets.
+    """
+    results = await asyncio.to_thread(search, q, max(1, min(limit, 100)))
+    return {"success": True, "results": results}
+
+@app.post("/api/search/reindex")
+async def api_reindex_search():
+    """
+    Indexes the cleaned chapters in the artifact manifest that aren't indexed yet,
+    after a running cycle.
+    """
+    counts = await asyncio.to_thread(run_exclusive, reindex)
+    return {
+        "success": True,
+        "message": f"Indexed {counts['indexed']} chapters, {counts['unchanged']} unchanged, {counts['missing']} missing, removed {counts['removed']}",
+        **counts
+    }
+
+
+# ============== Lease Endpoints ==============
+
+@app.get("/api/leases")
+async def api_get_leases():
+    """
+    Returns the work leases held by the replicas, with their owner and expiry.
+    """
+    leases = await asyncio.to_thread(get_lease_backend().all)
+    return {"success": True, "leases": leases}
+
+
+# ============== Outbox Endpoints ==============
+
+@app.get("/api/outbox")
+async def api_get_outbox():
+    """
+    Returns the staged emails with their delivery status, attempts and last error.
+    """
+    records = get_outbox()
+    outbox = [
+        {
+            "title": r["batch"]["entry"]["title"],
+            "feed": r["batch"]["feed"]["title"],
+            "recipient": r.get("recipient", ""),
+            "status": r["status"],
+            "attempts": r["attempts"],
+            "next_attempt": r["next_attempt"],
+            "last_error": r["last_error"],
+            "created": r["created"],
+            "sent_at": r["sent_at"],
+        }
+        for r in records
+    ]
+    return {"success": True, "outbox": outbox}
+
+
+@app.post("/api/outbox/retry")
+async def api_retry_outbox():
+    """
+    Requeues emails that ran out of attempts; they are sent on the next run.
+    """
+    requeued = retry_failed_outbox()
+    return {"success": True, "message": f"Requeued {requeued} emails"}
+
+
+# ============== Subscriber Endpoints ==============
+
+@app.get("/api/subscribers")
+async def api_get_subscribers():
+    subscribers = get_all_subscribers()
+    return {"success": True, "subscribers": [s.dict() for s in subscribers]}
+
+
+@app.post("/api/subscribers")
+async def api_add_subscriber(request: Request):
+    data = await request.json()
+    email = data.get("email", "").strip()
+    if not email:
+        return {"success": False, "message": "Email is required"}
+
+    subscriber = Subscriber(
+        email=email,
+        name=data.get("name", "").strip(),
+        feeds=[normalize_royal_road_url(url.strip()) for url in data.get("feeds", [])],
+        active=data.get("active", True)
+    )
+    if add_subscriber(subscriber):
+        return {"success": True, "message": "Subscriber added successfully"}
+    return {"success": False, "message": "Subscriber with this email already exists"}
+
+
+@app.put("/api/subscribers")
+async def api_update_subscriber(request: Request):
+    data = await request.json()
+    email = data.get("email", "").strip()
+    if not email:
+        return {"success": False, "message": "Email is required"}
+
+    updates = {}
+    if "name" in data:
+        updates["name"] = data["name"].strip()
+    if "feeds" in data:
+        updates["feeds"] = [normalize_royal_road_url(url.strip()) for url in data["feeds"]]
+    if "active" in data:
+        updates["active"] = data["active"]
+
+    if not updates:
+        return {"success": False, "message": "No updates provided"}
+
+    if update_subscriber(email, updates):
+        return {"success": True, "message": "Subscriber updated successfully"}
+    return {"success": False, "message": "Subscriber not found"}
+
+
+@app.delete("/api/subscribers")
+async def api_delete_subscriber(request: Request):
+    data = await request.json()
+    email = data.get("email", "").strip()
+    if not email:
+        return {"success": False, "message": "Email is required"}
+
+    if delete_subscriber(email):
+        return {"success": True, "message": "Subscriber deleted successfully"}
+    return {"success": False, "message": "Subscriber not found"}
+
+
 # ============== Feed Configuration Endpoints ==============
 
 @app.get("/configure", response_class=HTMLResponse)
@@ -132,6 +329,7 @@ async def api_add_feed(request: Request):
     name = data.get("name", "").strip()
     ignore = data.get("ignore", False)
     dry_run = data.get("dry_run", False)
+    digest = data.get("digest", False)
     
     if not url:
         return {"success": False, "message": "URL is required"}
@@ -139,7 +337,7 @@ async def api_add_feed(request: Request):
         return {"success": False, "message": "Name is required"}
     
     url = normalize_royal_road_url(url)
-    feed = FeedItem(name=name, url=url, ignore=ignore, dry_run=dry_run)
+    feed = FeedItem(name=name, url=url, ignore=ignore, dry_run=dry_run, digest=digest)
     success = add_feed(feed)
     
     if success:
@@ -162,6 +360,10 @@ async def api_update_feed(request: Request):
         updates["ignore"] = data["ignore"]
     if "dry_run" in data:
         updates["dry_run"] = data["dry_run"]
+    if "digest" in data:
+        updates["digest"] = data["digest"]
+    if data.get("reset_health"):
+        updates.update({"failures": 0, "last_error": "", "next_attempt": 0})
     
     if not updates:
         return {"success": False, "message": "No updates provided"}
@@ -203,24 +405,33 @@ async def api_fetch_feed_title(request: Request):
     
     url = normalize_royal_road_url(url)
     try:
-        parsed = feedparser.parse(url)
-        if parsed.bozo and not parsed.entries:
-            return {"success": False, "message": "Could not parse feed URL"}
-        
-        title = getattr(parsed.feed, 'title', '') or ''
+        title = await asyncio.to_thread(fetch_feed_title, url)
         if not title:
             return {"success": False, "message": "Feed has no title"}
         
         clean_title = strip_brackets_from_title(title)
         return {"success": True, "title": clean_title, "original_title": title}
+    except ValueError:
+        return {"success": False, "message": "Could not parse feed URL"}
     except Exception as e:
         logger.error(f"Error fetching feed title: {e}")
         return {"success": False, "message": "Failed to fetch feed"}
 
-# @app.on_event("startup")
-# async def startup_event():
-#     if not DEBUG_MODE:
-#         asyncio.create_task(run_periodic_updates())
+@app.on_event("startup")
+async def startup_event():
+    # Deferred from import time so the app starts serving as soon as possible
+    init_db()
+    load_keywords()
+    start_recheck_scheduler(recheck_patreon_entries)
+    # Fills the manifest after an upgrade before the first cycle, which waits for it
+    asyncio.create_task(asyncio.to_thread(run_exclusive, MANIFEST.reconcile_if_empty))
+    # if not DEBUG_MODE:
+    #     asyncio.create_task(run_periodic_updates())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    stop_recheck_scheduler()
 
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=9000, reload=True)
@@ -0,0 +1,167 @@
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from urllib.parse import urlparse
+
+# Upper bounds in seconds, spanning a fast DB lookup up to a slow pandoc run or SMTP send
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """
+    A monotonically increasing counter with labels, rendered in Prometheus text format.
+    """
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    A cumulative bucketed histogram with labels, rendered in Prometheus text format.
+    Quantiles (p50/p95) are computed server side with histogram_quantile().
+    """
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def totals(self, labelname: str) -> dict:
+        """
+        Returns {label value: (count, total seconds)} aggregated over the other labels.
+        """
+        index = self.labelnames.index(labelname)
+        totals = {}
+        with self._lock:
+            for key, (_, total, count) in self._values.items():
+                previous_count, previous_total = totals.get(key[index], (0, 0.0))
+                totals[key[index]] = (previous_count + count, previous_total + total)
+        return totals
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "webtoepub_stage_duration_seconds",
+    "Time spent in each pipeline stage.",
+    ["stage", "feed", "site"]
+)
+STAGE_ERRORS = Counter(
+    "webtoepub_stage_errors_total",
+    "Number of pipeline stage executions that failed.",
+    ["stage", "feed", "site"]
+)
+DB_SECONDS = Histogram(
+    "webtoepub_db_duration_seconds",
+    "Time spent in database calls.",
+    ["operation"]
+)
+CHAPTER_BYTES = Histogram(
+    "webtoepub_chapter_bytes",
+    "Size of each chapter as downloaded, after cleaning and as EPUB.",
+    ["stage", "feed", "site"],
+    buckets=(4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+)
+REGISTRY = [STAGE_SECONDS, STAGE_ERRORS, DB_SECONDS, CHAPTER_BYTES]
+
+
+def site_of(url: str) -> str:
+    """
+    Returns the host of a url without the www prefix, used as the site label.
+    """
+    host = urlparse(url).hostname or ""
+    return host[4:] if host.startswith("www.") else host
+
+
+@contextmanager
+def timed(stage: str, feed: str = "", site: str = ""):
+    """
+    Times the enclosed block as one execution of a pipeline stage.
+    Exceptions are counted as stage errors and re-raised.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage, feed=feed, site=site)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage, feed=feed, site=site)
+
+
+def timed_db(func):
+    """
+    Decorator recording the duration of a database function under its name.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - start, operation=func.__name__)
+    return wrapper
+
+
+def render_metrics() -> str:
+    """
+    Renders every registered metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -13,6 +13,11 @@ class FeedItem(BaseModel):
     url: str
     ignore: Optional[bool] = False
     dry_run: Optional[bool] = False
+    digest: Optional[bool] = False
+    # Health of the feed, see feeder.feed_allowed
+    failures: Optional[int] = 0
+    last_error: Optional[str] = ""
+    next_attempt: Optional[int] = 0
 
 class Feed(BaseModel):
     feeds: list[FeedItem]
@@ -29,6 +34,8 @@ class Entry(BaseModel):
     published_parsed: tuple
     time_sent: Optional[int] = 0
     patreon_lock: Optional[int] = 0
+    # Hash of the cleaned chapter, see dedup.py
+    content_hash: Optional[str] = ""
 
     def get_date(self) -> str:
         return time.strftime("%Y-%m-%d", self.published_parsed)
@@ -48,7 +55,19 @@ class Entry(BaseModel):
     def get_file_name(self) -> str:
         return self.title.replace(" ", "_")
 
+class Subscriber(BaseModel):
+    email: str
+    name: str = ""
+    # Feed urls to deliver, every feed when empty
+    feeds: list[str] = []
+    active: bool = True
+
+    def wants(self, feed: FeedItem) -> bool:
+        return self.active and (not self.feeds or feed.url in self.feeds)
+
 class EmailBatch(BaseModel):
     entry: Entry
     feed: FeedItem
     epub_path: str
+    # The chapters bundled in a digest, recorded once the digest is delivered
+    chapters: list[Entry] = []
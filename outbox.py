@@ -0,0 +1,172 @@
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List
+from db import (
+    add_entry, has_entry, get_all_subscribers, enqueue_outbox, claim_due_outbox, mark_outbox_sent, mark_outbox_failed,
+    clear_digest_entries
+)
+from mail import TO_EMAIL, SMTPSession
+from metrics import timed, site_of, STAGE_ERRORS
+from models import EmailBatch, FeedItem, Subscriber
+from utils import custom_logger
+
+OUTBOX_SEND_WORKERS = int(os.getenv("OUTBOX_SEND_WORKERS", "1"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_RETRY_BASE_SECONDS = int(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "60"))
+OUTBOX_RETRY_MAX_SECONDS = int(os.getenv("OUTBOX_RETRY_MAX_SECONDS", 6 * 3600))
+# An email claimed longer ago than this was lost to a crash mid-send and is tried again
+OUTBOX_CLAIM_TIMEOUT_SECONDS = int(os.getenv("OUTBOX_CLAIM_TIMEOUT_SECONDS", "3600"))
+logger = custom_logger(__name__)
+
+
+def idempotency_key(batch: EmailBatch, recipient: str) -> str:
+    """
+    Identifies an email by what it delivers to whom, so staging the same chapter
+    for the same reader again is a no-op.
+    """
+    return hashlib.sha256(f"{batch.entry.link}|{os.path.basename(batch.epub_path)}|{recipient}".encode("utf-8")).hexdigest()
+
+
+def retry_delay(attempts: int) -> int:
+    return min(OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1), OUTBOX_RETRY_MAX_SECONDS)
+
+
+def recipients(feed: FeedItem, subscribers: List[Subscriber]) -> List[str]:
+    """
+    Returns the addresses a feed is delivered to. Without subscribers, that is TO_EMAIL.
+    """
+    if not subscribers:
+        return [TO_EMAIL]
+    return [subscriber.email for subscriber in subscribers if subscriber.wants(feed)]
+
+
+def record_delivery(batch: EmailBatch):
+    """
+    Records the entry of a delivered email in the database, and for a digest every
+    chapter in it. With several subscribers, the first delivery records them.
+    """
+    now = int(time.time())
+    for entry in [batch.entry, *batch.chapters]:
+        if not has_entry(entry):
+            entry.time_sent = now
+            add_entry(entry, batch.feed)
+    if batch.chapters:
+        clear_digest_entries(batch.feed.url, [entry.link for entry in batch.chapters])
+
+
+def stage_emails(email_batch: List[EmailBatch], known=None) -> int:
+    """
+    Stages an email per subscriber of each batch's feed in the outbox. The EPUB is
+    shared, only the sending is repeated. With known (dedup.KnownChapters), recipients
+    that already got the chapter under another link are skipped. Entries nobody gets an
+    email for are recorded as handled, so they aren't prepared again.
+    Returns how many emails were new.
+    """
+    subscribers = get_all_subscribers()
+    staged = 0
+    for batch in email_batch:
+        addresses = recipients(batch.feed, subscribers)
+        if not addresses:
+            logger.info(f"No subscriber wants {batch.feed.name}, not sending {batch.entry.title}")
+            record_delivery(batch)
+            continue
+        new_addresses = []
+        for recipient in addresses:
+            duplicate = known.duplicate_of(batch.entry.link, batch.entry.content_hash, [recipient]) if known else None
+            if duplicate:
+                logger.info(f"Not sending {batch.entry.title} to {recipient}, who got it as {duplicate}")
+            else:
+                new_addresses.append(recipient)
+        if not new_addresses:
+            record_delivery(batch)
+            continue
+        for recipient in new_addresses:
+            if enqueue_outbox(idempotency_key(batch, recipient), batch, recipient):
+                staged += 1
+        if known:
+            known.add(batch.entry.link, batch.entry.content_hash, new_addresses)
+    return staged
+
+
+def deliver(session: SMTPSession, batch: EmailBatch, recipient: str) -> str | None:
+    """
+    Sends one email. Returns None once it was accepted, otherwise why it failed.
+    """
+    logger.info(f"Sending email with EPUB file {batch.epub_path} to {recipient}")
+    with timed("send", batch.feed.name, site_of(batch.entry.link)):
+        if not os.path.exists(batch.epub_path):
+            logger.error(f"EPUB file not found: {batch.epub_path}")
+            return f"EPUB file not found: {batch.epub_path}"
+        try:
+            session.send(
+                subject=f"{batch.feed.title} - {batch.entry.title}",
+                content=f"EPUB file for {batch.entry.title} is attached.",
+                attachment_path=batch.epub_path,
+                to_email=recipient
+            )
+            return None
+        except Exception as e:
+            logger.exception(f"Failed to send email: {e}")
+            return f"{type(e).__name__}: {e}"
+
+
+def deliver_all(records: List[dict]) -> List[str | None]:
+    """
+    Sends the emails of records in order over one SMTP session.
+    """
+    with SMTPSession() as session:
+        return [
+            deliver(session, EmailBatch(**record["batch"]), record.get("recipient") or TO_EMAIL)
+            for record in records
+        ]
+
+
+def drain_outbox() -> int:
+    """
+    Sends every email in the outbox that is due, over OUTBOX_SEND_WORKERS SMTP sessions.
+    Entries are only recorded as sent once their email was accepted; failed emails
+    are retried with exponential backoff until OUTBOX_MAX_ATTEMPTS.
+    Returns the number of emails sent.
+    """
+    now = int(time.time())
+    records = claim_due_outbox(now, now - OUTBOX_CLAIM_TIMEOUT_SECONDS)
+    if not records:
+        return 0
+    workers = max(1, min(OUTBOX_SEND_WORKERS, len(records)))
+    logger.info(f"Sending {len(records)} emails from the outbox over {workers} connections")
+
+    sent = 0
+    # Only the SMTP sends run on the worker threads, database updates stay on this one
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for i in range(workers):
+            share = records[i::workers]
+            futures[executor.submit(deliver_all, share)] = share
+        for future in as_completed(futures):
+            share = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                logger.exception(f"Error sending emails: {e}")
+                results = [f"{type(e).__name__}: {e}"] * len(share)
+
+            for record, error in zip(share, results):
+                batch = EmailBatch(**record["batch"])
+                if error is None:
+                    mark_outbox_sent(record["key"])
+                    record_delivery(batch)
+                    sent += 1
+                    continue
+
+                STAGE_ERRORS.inc(stage="send", feed=batch.feed.name, site=site_of(batch.entry.link))
+                attempts = record["attempts"] + 1
+                give_up = attempts >= OUTBOX_MAX_ATTEMPTS
+                next_attempt = int(time.time()) + retry_delay(attempts)
+                mark_outbox_failed(record["key"], attempts, next_attempt, error[:500], give_up)
+                if give_up:
+                    logger.error(f"Giving up on {batch.entry.title} after {attempts} attempts")
+                else:
+                    logger.warning(f"Sending {batch.entry.title} failed, retrying in {retry_delay(attempts)}s")
+    return sent
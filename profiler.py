@@ -0,0 +1,94 @@
+import cProfile
+import os
+import pstats
+import re
+import time
+import uuid
+from utils import custom_logger
+
+CONFIG_PATH = os.getenv("CONFIG_PATH", "/config")
+PROFILE_PATH = os.path.join(CONFIG_PATH, "profiles")
+PROFILE_EXECUTE = os.getenv("PROFILE_EXECUTE", "false") == "true"
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+RUN_ID_PATTERN = re.compile(r"^\d{8}-\d{6}-[0-9a-f]{8}$")
+THREAD_NOTE = "Only the thread running execute is profiled, work on pool threads (conversion, images, SMTP) shows up as waits"
+logger = custom_logger(__name__)
+
+
+def new_run_id() -> str:
+    return time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:8]
+
+
+def profile_file(run_id: str) -> str | None:
+    """
+    Returns the path of the profile stored for a run, or None if there is none.
+    """
+    if not RUN_ID_PATTERN.match(run_id):
+        return None
+    path = os.path.join(PROFILE_PATH, f"{run_id}.prof")
+    return path if os.path.exists(path) else None
+
+
+def list_profiles() -> list[str]:
+    """
+    Lists the run IDs that have a stored profile, newest first.
+    """
+    if not os.path.exists(PROFILE_PATH):
+        return []
+    run_ids = [name[:-len(".prof")] for name in os.listdir(PROFILE_PATH) if name.endswith(".prof")]
+    return sorted((run_id for run_id in run_ids if RUN_ID_PATTERN.match(run_id)), reverse=True)
+
+
+def prune_profiles(keep: int = PROFILE_KEEP):
+    """
+    Deletes all but the newest keep profiles.
+    """
+    for run_id in list_profiles()[keep:]:
+        os.remove(os.path.join(PROFILE_PATH, f"{run_id}.prof"))
+
+
+def run_profiled(func, *args, **kwargs) -> str:
+    """
+    Runs func under cProfile and stores the profile under CONFIG_PATH/profiles.
+    Returns the run ID the profile was stored with. cProfile only sees the calling
+    thread: EPUB conversions, image fetches and SMTP sends run on pool threads and
+    show up as time spent waiting on their futures.
+    """
+    run_id = new_run_id()
+    os.makedirs(PROFILE_PATH, exist_ok=True)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        path = os.path.join(PROFILE_PATH, f"{run_id}.prof")
+        profiler.dump_stats(path)
+        logger.info(f"Profile for run {run_id} saved to {path}")
+        prune_profiles()
+    return run_id
+
+
+def profile_summary(run_id: str, limit: int = 30) -> dict | None:
+    """
+    Summarizes a stored profile with its top functions by cumulative time.
+    """
+    path = profile_file(run_id)
+    if not path:
+        return None
+    stats = pstats.Stats(path)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+    functions = []
+    for (file_name, line, function_name), (_, calls, total_time, cumulative_time, _) in rows[:limit]:
+        functions.append({
+            "function": f"{file_name}:{line}({function_name})",
+            "calls": calls,
+            "total_time": round(total_time, 6),
+            "cumulative_time": round(cumulative_time, 6),
+        })
+    return {
+        "run_id": run_id,
+        "total_time": round(stats.total_tt, 6),
+        "functions": functions,
+        "note": THREAD_NOTE,
+    }
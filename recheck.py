@@ -0,0 +1,90 @@
+import os
+import threading
+import time
+from typing import Callable, List
+from db import schedule_patreon_recheck, next_patreon_recheck, pop_due_patreon_rechecks
+from models import Entry, FeedItem
+from utils import custom_logger
+
+PATREON_RECHECK = os.getenv("PATREON_RECHECK", "true") == "true"
+# Upper bound on a sleep, so rechecks queued by another process are still picked up
+RECHECK_MAX_SLEEP_SECONDS = 3600
+RECHECK_ERROR_DELAY_SECONDS = 60
+logger = custom_logger(__name__)
+
+_scheduler = None
+
+
+class RecheckScheduler:
+    """
+    A background thread that sleeps until the earliest patreon lock in the queue
+    expires, then hands the expired entries to handler. Queuing an entry wakes
+    the thread so it can sleep for a shorter time.
+    """
+    def __init__(self, handler: Callable[[List[tuple[Entry, FeedItem]]], None]):
+        self.handler = handler
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="patreon-recheck", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join(timeout=5)
+
+    def wake(self):
+        with self._condition:
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            try:
+                with self._condition:
+                    if self._stopped:
+                        return
+                    due = next_patreon_recheck()
+                    delay = RECHECK_MAX_SLEEP_SECONDS if due is None else due - time.time()
+                    if delay > 0:
+                        self._condition.wait(min(delay, RECHECK_MAX_SLEEP_SECONDS))
+                    if self._stopped:
+                        return
+                rechecks = pop_due_patreon_rechecks(int(time.time()))
+                if not rechecks:
+                    continue
+                logger.info(f"Patreon lock expired on {len(rechecks)} entries, downloading them again")
+                self.handler(rechecks)
+            except Exception as e:
+                logger.exception(f"Error rechecking patreon-locked entries: {e}")
+                # Don't spin on a persistent error, e.g. an unreadable database
+                with self._condition:
+                    if not self._stopped:
+                        self._condition.wait(RECHECK_ERROR_DELAY_SECONDS)
+
+
+def schedule_recheck(entry: Entry, feed: FeedItem):
+    """
+    Queues a patreon-locked entry for when its lock expires.
+    """
+    schedule_patreon_recheck(entry, feed)
+    if _scheduler is not None:
+        _scheduler.wake()
+
+
+def start_recheck_scheduler(handler: Callable[[List[tuple[Entry, FeedItem]]], None]):
+    global _scheduler
+    if not PATREON_RECHECK or _scheduler is not None:
+        return
+    _scheduler = RecheckScheduler(handler)
+    _scheduler.start()
+    logger.info("Started the patreon recheck scheduler")
+
+
+def stop_recheck_scheduler():
+    global _scheduler
+    if _scheduler is not None:
+        _scheduler.stop()
+        _scheduler = None
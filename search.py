@@ -0,0 +1,166 @@
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+from utils import custom_logger
+
+CONFIG_PATH = os.getenv("CONFIG_PATH", "/config")
+SEARCH_INDEX = os.getenv("SEARCH_INDEX", "true") == "true"
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", os.path.join(CONFIG_PATH, "search.sqlite"))
+SEARCH_SNIPPET_TOKENS = 16
+TERM_PATTERN = re.compile(r"\w+\*?", re.UNICODE)
+logger = custom_logger(__name__)
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+@contextmanager
+def _connect():
+    global _schema_ready
+    if not _schema_ready:
+        os.makedirs(os.path.dirname(SEARCH_INDEX_PATH) or ".", exist_ok=True)
+    connection = sqlite3.connect(SEARCH_INDEX_PATH, timeout=30)
+    try:
+        with _schema_lock:
+            if not _schema_ready:
+                connection.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS chapters USING fts5("
+                    "link UNINDEXED, title, feed UNINDEXED, path UNINDEXED, sha256 UNINDEXED, body, "
+                    "tokenize = 'porter unicode61 remove_diacritics 2')"
+                )
+                # UNINDEXED columns can only be searched by scanning the whole table,
+                # so chapters are found by link here and replaced by rowid
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS chapter_rows (link TEXT PRIMARY KEY, row INTEGER NOT NULL, sha256 TEXT)"
+                )
+                if not connection.execute("SELECT 1 FROM chapter_rows LIMIT 1").fetchone():
+                    connection.execute("INSERT OR REPLACE INTO chapter_rows SELECT link, rowid, sha256 FROM chapters")
+                connection.commit()
+                _schema_ready = True
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def chapter_text(html: str) -> str:
+    """
+    Returns the readable text of a cleaned chapter.
+    """
+    import lxml.html
+    from lxml.etree import ParserError
+
+    try:
+        return " ".join(lxml.html.fragment_fromstring(html, create_parent="div").text_content().split())
+    except ParserError:
+        return ""
+
+
+def _delete(connection: sqlite3.Connection, link: str):
+    row = connection.execute("SELECT row FROM chapter_rows WHERE link = ?", (link,)).fetchone()
+    if row:
+        connection.execute("DELETE FROM chapters WHERE rowid = ?", row)
+        connection.execute("DELETE FROM chapter_rows WHERE link = ?", (link,))
+
+
+def _store(connection: sqlite3.Connection, link: str, title: str, feed: str, path: str, html: str, replace: bool = True):
+    digest = hashlib.sha256(html.encode("utf-8")).hexdigest()
+    if replace:
+        _delete(connection, link)
+    cursor = connection.execute(
+        "INSERT INTO chapters (link, title, feed, path, sha256, body) VALUES (?, ?, ?, ?, ?, ?)",
+        (link, title, feed, path, digest, chapter_text(html)),
+    )
+    connection.execute(
+        "INSERT OR REPLACE INTO chapter_rows (link, row, sha256) VALUES (?, ?, ?)",
+        (link, cursor.lastrowid, digest),
+    )
+
+
+def index_chapter(link: str, title: str, feed: str, path: str, html: str):
+    """
+    Adds a cleaned chapter to the search index, replacing an earlier version of it.
+    """
+    if not SEARCH_INDEX:
+        return
+    with _connect() as connection:
+        _store(connection, link, title, feed, path, html)
+
+
+def remove_chapter(link: str):
+    if not SEARCH_INDEX or not os.path.exists(SEARCH_INDEX_PATH):
+        return
+    with _connect() as connection:
+        _delete(connection, link)
+
+
+def match_expression(query: str) -> str:
+    """
+    Turns a search box query into an FTS5 expression matching chapters that contain
+    every word. A trailing * matches word prefixes, other FTS5 syntax is taken literally.
+    """
+    terms = []
+    for term in TERM_PATTERN.findall(query):
+        prefix = term.endswith("*")
+        terms.append(f'"{term.rstrip("*")}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def search(query: str, limit: int = 20) -> list[dict]:
+    """
+    Returns the chapters matching query, best match first (title matches weigh more),
+    with a snippet of the text around the match.
+    """
+    expression = match_expression(query)
+    if not expression or not os.path.exists(SEARCH_INDEX_PATH):
+        return []
+    with _connect() as connection:
+        rows = connection.execute(
+            "SELECT link, title, feed, snippet(chapters, 5, '<mark>', '</mark>', '…', ?) "
+            "FROM chapters WHERE chapters MATCH ? ORDER BY bm25(chapters, 0, 5.0, 0, 0, 0, 1.0) LIMIT ?",
+            (SEARCH_SNIPPET_TOKENS, expression, limit),
+        ).fetchall()
+    return [dict(zip(("link", "title", "feed", "snippet"), row)) for row in rows]
+
+
+def reindex() -> dict:
+    """
+    Indexes every cleaned chapter in the artifact manifest that isn't indexed in its
+    current version yet, and drops chapters that are no longer in the manifest.
+    Returns counts of the indexed, unchanged, missing and removed chapters.
+    """
+    from db import get_all_artifacts
+
+    counts = {"indexed": 0, "unchanged": 0, "missing": 0, "removed": 0}
+    records = {r["link"]: r for r in get_all_artifacts() if r.get("cleaned")}
+    with _connect() as connection:
+        indexed = dict(connection.execute("SELECT link, sha256 FROM chapter_rows").fetchall())
+        for link in set(indexed) - set(records):
+            _delete(connection, link)
+            counts["removed"] += 1
+        for link, record in records.items():
+            path = record["cleaned"]["path"]
+            if indexed.get(link) == record["cleaned"].get("sha256"):
+                counts["unchanged"] += 1
+                continue
+            try:
+                with open(path, "r") as f:
+                    html = f.read()
+            except OSError:
+                counts["missing"] += 1
+                continue
+            _store(connection, link, record.get("title", ""), record.get("feed", ""), path, html, replace=link in indexed)
+            counts["indexed"] += 1
+    logger.info(f"Search index rebuilt: {counts}")
+    return counts
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["reindex"]:
+        print("usage: python search.py reindex")
+        sys.exit(2)
+    print(reindex())
@@ -0,0 +1,130 @@
+from typing import List
+from utils import custom_logger
+
+logger = custom_logger(__name__)
+
+
+class WatermarkRule:
+    """
+    Removes the first element among tags whose text is a short sentence (at most
+    max_spaces spaces) mentioning min_keywords or more of the watermark keywords.
+    """
+    def __init__(self, tags: List[str], max_spaces: int = 25, min_keywords: int = 2):
+        self.tags = tags
+        self.max_spaces = max_spaces
+        self.min_keywords = min_keywords
+
+    def apply(self, element, keywords: List[str]) -> bool:
+        keywords = [keyword.lower() for keyword in keywords]
+        for candidate in element.iterdescendants(*self.tags):
+            text = candidate.text_content().strip()
+            if " " not in text or text.count(" ") > self.max_spaces:
+                continue
+            lowered = text.lower()
+            if sum(1 for keyword in keywords if keyword in lowered) >= self.min_keywords:
+                logger.info(f"Extracted watermark: {text}")
+                candidate.drop_tree()
+                return True
+        return False
+
+
+class SiteRule:
+    """
+    How to pull the chapter text out of a site's pages, as CSS selectors:
+    containers are applied in turn, each searching inside the previous match,
+    remove and images are dropped from the chapter, images only when they
+    aren't embedded. embed_images marks the sites whose images are embedded
+    with EMBED_IMAGES. Selectors are compiled to XPath on first use.
+    """
+    def __init__(
+        self,
+        name: str,
+        containers: List[str],
+        remove: List[str] = (),
+        images: List[str] = (),
+        watermark: WatermarkRule | None = None,
+        embed_images: bool = False,
+    ):
+        self.name = name
+        self.containers = list(containers)
+        self.remove = list(remove)
+        self.images = list(images)
+        self.watermark = watermark
+        self.embed_images = embed_images
+        self._compiled = None
+
+    def compiled(self) -> dict:
+        if self._compiled is None:
+            from lxml.cssselect import CSSSelector
+            self._compiled = {
+                "containers": [(selector, CSSSelector(selector)) for selector in self.containers],
+                "remove": [CSSSelector(selector) for selector in self.remove],
+                "images": [CSSSelector(selector) for selector in self.images],
+            }
+        return self._compiled
+
+
+# Keyed by EntryType value
+SITE_RULES = {
+    "royalroad": SiteRule(
+        name="royalroad",
+        containers=["div.chapter-inner.chapter-content"],
+        watermark=WatermarkRule(["p", "div", "span"]),
+    ),
+    "wanderinginn": SiteRule(
+        name="wanderinginn",
+        containers=["div.reader-container", "div.elementor-widget-theme-post-content"],
+        remove=["div.video-player", "span.embed-youtube"],
+        images=["img", "div.gallery"],
+        embed_images=True,
+    ),
+}
+
+
+def clean_page(
+    html_content: str,
+    rule: SiteRule,
+    page_url: str = "",
+    keywords: List[str] = (),
+    embed_images: bool = False,
+    compact: bool = True,
+) -> str:
+    """
+    Extracts and cleans the chapter of a downloaded page following rule,
+    working on the lxml tree directly. Images are only embedded for rules that
+    allow it. Returns "" if the chapter isn't found.
+    """
+    import lxml.html
+    from lxml.etree import ParserError
+    from compact import compact_tree
+
+    try:
+        element = lxml.html.document_fromstring(html_content)
+    except ParserError:
+        logger.warning(f"Could not parse the {rule.name} page")
+        return ""
+
+    compiled = rule.compiled()
+    for selector, container in compiled["containers"]:
+        matches = container(element)
+        if not matches:
+            logger.warning(f"Could not find {selector} in the {rule.name} page")
+            return ""
+        element = matches[0]
+
+    for selector in compiled["remove"]:
+        for match in selector(element):
+            match.drop_tree()
+    if embed_images and rule.embed_images:
+        from images import embed_images_tree
+        embed_images_tree(element, page_url)
+    else:
+        for selector in compiled["images"]:
+            for match in selector(element):
+                match.drop_tree()
+    if rule.watermark and not rule.watermark.apply(element, keywords):
+        logger.warning("Could not find any paragraphs matching criteria")
+
+    if compact:
+        return compact_tree(element)
+    return lxml.html.tostring(element, encoding="unicode", with_tail=False)
@@ -1,21 +1,161 @@
+import atexit
+import contextvars
+import copy
+import json
 import logging
+import logging.handlers
 import os
+import queue
 import shutil
+import threading
+from contextlib import contextmanager
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "text" or "json", one object per line with the run, feed and entry a line belongs to
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# Write log lines from a background thread instead of the thread that logs them
+LOG_QUEUE = os.getenv("LOG_QUEUE", "true") == "true"
+# module=N keeps the first and then every Nth info or debug line of each call site in module, e.g. "feeder=10,db=100"
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "")
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+CONTEXT_FIELDS = ("run_id", "feed", "entry")
+
+_log_context = contextvars.ContextVar("log_context", default={})
+_handler = None
+_handler_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "file": f"{record.filename}:{record.lineno}",
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value:
+                data[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Renders the message and traceback for the queue, leaving the layout to the
+        listener's formatter so JSON output keeps the exception in its own field.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class ContextFilter(logging.Filter):
+    """
+    Copies the fields of log_context onto each record, in the thread that logs it.
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        for field, value in _log_context.get().items():
+            setattr(record, field, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps the first and then every Nth info or debug record of each call site in the
+    modules rates names. Warnings and errors are always kept.
+    """
+    def __init__(self, rates: dict[str, int]):
+        super().__init__()
+        self.rates = rates
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.name)
+        if not rate or record.levelno > logging.INFO:
+            return True
+        key = (record.name, record.lineno)
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        return count % rate == 0
+
+
+def _sample_rates(value: str) -> dict[str, int]:
+    rates = {}
+    for item in value.split(","):
+        name, _, rate = item.partition("=")
+        if name.strip() and rate.strip().isdigit() and int(rate) > 1:
+            rates[name.strip()] = int(rate)
+    return rates
+
+
+def _shared_handler() -> logging.Handler:
+    """
+    Returns the handler every module logger writes through, creating it on first use.
+    With LOG_QUEUE, records are put on a queue and written by a listener thread.
+    """
+    global _handler
+    with _handler_lock:
+        if _handler is None:
+            stream = logging.StreamHandler()
+            if LOG_FORMAT == "json":
+                stream.setFormatter(JsonFormatter())
+            else:
+                stream.setFormatter(logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT))
+            if LOG_QUEUE:
+                log_queue = queue.SimpleQueue()
+                handler = LogQueueHandler(log_queue)
+                listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+                listener.start()
+                # Writes out what is still queued
+                atexit.register(listener.stop)
+            else:
+                handler = stream
+            handler.addFilter(SamplingFilter(_sample_rates(LOG_SAMPLE)))
+            handler.addFilter(ContextFilter())
+            _handler = handler
+        return _handler
+
 
 def custom_logger(name):
+    """
+    Returns the logger of a module, writing through the shared handler.
+    Safe to call repeatedly, the handler is only added once.
+    """
     logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)  # Set your desired logging level
+    logger.setLevel(LOG_LEVEL)
+    handler = _shared_handler()
+    if handler not in logger.handlers:
+        logger.addHandler(handler)
+    return logger
 
-    formatter = logging.Formatter(
-        "%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S"  # Customize date format as needed
-    )
 
-    handler = logging.StreamHandler() # Or a FileHandler if you want to write to a file
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+@contextmanager
+def log_context(**fields):
+    """
+    Adds fields such as run_id, feed and entry to the records logged in the block.
+    """
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
 
-    return logger
+
+logger = custom_logger(__name__)
 
 def sanitize_filename(filename: str) -> str:
     """
@@ -26,15 +166,15 @@ def sanitize_filename(filename: str) -> str:
         filename = filename.replace(char, '-')
     return filename
 
-def delete_entry_files(entry_title: str, feed_title: str, download_path: str):
+def delete_entry_files(entry_title: str, feed_title: str, download_path: str, file_paths: list[str] | None = None):
     """
     Deletes all files related to an entry (html, cleaned, epub).
+    file_paths, when known from the artifact manifest, replaces the paths derived from the titles.
     """
-    logger = custom_logger(__name__)
     feed_path = os.path.join(download_path, sanitize_filename(feed_title))
     sanitized_title = sanitize_filename(entry_title)
     
-    files_to_delete = [
+    files_to_delete = file_paths or [
         os.path.join(feed_path, "html", f"{sanitized_title}.html"),
         os.path.join(feed_path, "cleaned", f"{sanitized_title}.html"),
         os.path.join(feed_path, f"{sanitized_title}.epub")
@@ -1,19 +1,23 @@
 #!/usr/local/bin/python3
 import argparse
-import feedparser
-from bs4 import BeautifulSoup
 import pickle
+import shutil
+import tempfile
+import threading
+import posixpath
+import re
+import struct
 import time
 import subprocess
-from requests_html import HTMLSession
 import ssl
 import os
 import json
-from ebooklib import epub
+import zlib
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 filename = os.path.join(script_dir, 'keywords.txt')
 DELAY_FOR_EPUB_CHAPTER = 86400 * 1.75
+KINDLE_EMAIL = "mnishamk95@kindle.com"
 # DELAY_FOR_EPUB_CHAPTER = 1
 
 with open(filename, 'r') as file:
@@ -24,34 +28,276 @@ parser.add_argument('-n', '--dry-run', action='store_true')
 parser.add_argument('-u', '--update-db', action='store_true')
 parser.add_argument('-i', '--remove-images', action='store_true')
 parser.add_argument('-l', '--link', default=None)
+parser.add_argument('-j', '--jobs', type=int, default=1, help='number of feeds converted and sent in parallel')
+parser.add_argument('--compact', action='store_true', help='rewrite the completion log without removed and duplicate records, then exit')
 args = parser.parse_args()
 
 scriptPath = os.path.dirname(os.path.abspath(__file__))
+# Compact the log once it holds this many times more lines than live records
+COMPACT_RATIO = 2
+COMPACT_MIN_LINES = 1000
+
+
+class CompletionLog:
+    """
+    Append-only record of completed links, one JSON object per line. Loaded once per run
+    into a hash index; completing or removing a link appends a line instead of rewriting
+    the whole history. Replaces the pickled list in completedObjects.db, which is migrated
+    on first use.
+    """
+    def __init__(self, path, legacyPath=None):
+        self.path = path
+        self.records = {}  # link -> {"link", "date"}
+        self.lastChapters = {}  # feed name -> last chapter sent in drip mode
+        self.lastDate = None
+        self.lines = 0
+        # Feeds run on several threads with --jobs
+        self.lock = threading.Lock()
+        if not os.path.exists(path) and legacyPath and os.path.exists(legacyPath):
+            self.migrate(legacyPath)
+        self.load()
+
+    def migrate(self, legacyPath):
+        with open(legacyPath, "rb") as data:
+            completedUrls = pickle.load(data)
+        with open(self.path + ".tmp", "w") as f:
+            for obj in completedUrls:
+                f.write(json.dumps({"link": obj["link"], "date": obj["date"]}) + "\n")
+        os.replace(self.path + ".tmp", self.path)
+        print(f"Migrated {len(completedUrls)} completed links from {legacyPath}")
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    self.lines += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash mid-append
+                        continue
+                    self.apply(record)
+        except FileNotFoundError:
+            pass
+
+    def apply(self, record):
+        link = record["link"]
+        if record.get("removed"):
+            self.records.pop(link, None)
+            return
+        self.records[link] = record
+        if self.lastDate is None or record["date"] > self.lastDate:
+            self.lastDate = record["date"]
+        if link.startswith("chapter:"):
+            name, _, number = link[len("chapter:"):].rpartition(":")
+            self.lastChapters[name] = max(self.lastChapters.get(name, 0), int(number))
+
+    def append(self, record):
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+            self.lines += 1
+            self.apply(record)
+
+    def contains(self, link):
+        return link in self.records
+
+    def complete(self, link, date=None):
+        self.append({"link": link, "date": int(time.time()) if date is None else date})
+
+    def remove(self, link):
+        if link in self.records:
+            self.append({"link": link, "removed": True})
+            # Removing a drip chapter rewinds to the last one still recorded
+            self.lastChapters = {}
+            for other in self.records:
+                if other.startswith("chapter:"):
+                    name, _, number = other[len("chapter:"):].rpartition(":")
+                    self.lastChapters[name] = max(self.lastChapters.get(name, 0), int(number))
+            self.lastDate = max((r["date"] for r in self.records.values()), default=None)
+
+    def needsCompaction(self):
+        return self.lines >= COMPACT_MIN_LINES and self.lines > COMPACT_RATIO * len(self.records)
+
+    def compact(self):
+        with open(self.path + ".tmp", "w") as f:
+            for record in self.records.values():
+                f.write(json.dumps(record) + "\n")
+        os.replace(self.path + ".tmp", self.path)
+        print(f"Compacted completion log from {self.lines} to {len(self.records)} lines")
+        self.lines = len(self.records)
+
+
+def sendToKindle(subject, attachment):
+    subprocess.run(
+        ["mutt", "-s", subject, "-a", attachment, "--", KINDLE_EMAIL],
+        input=b"book\n",
+        check=True,
+        cwd=scriptPath,
+    )
+
+
+def openCompletionLog():
+    log = CompletionLog(
+        os.path.join(scriptPath, "completedObjects.log"),
+        os.path.join(scriptPath, "completedObjects.db"),
+    )
+    if args.compact or log.needsCompaction():
+        log.compact()
+    return log
+
+
+EPUB_INDEX_VERSION = 1
+CONTAINER_PATH = "META-INF/container.xml"
+OPF_NAMESPACE = "{http://www.idpf.org/2007/opf}"
+CONTAINER_NAMESPACE = "{urn:oasis:names:tc:opendocument:xmlns:container}"
+LINK_PATTERN = re.compile(r'(?:href|src)=["\']([^"\'#?]+)')
+CSS_URL_PATTERN = re.compile(r'url\(\s*["\']?([^"\')#?]+)')
+ZIP_LOCAL_HEADER = struct.Struct("<4s5H3I2H")
+
+
+def zipMemberInfo(info):
+    return {
+        "offset": info.header_offset,
+        "compression": info.compress_type,
+        "compressedSize": info.compress_size,
+    }
+
+
+def readZipMember(f, member):
+    """
+    Reads one member of an open zip file from its indexed offset, without the central directory.
+    """
+    f.seek(member["offset"])
+    header = ZIP_LOCAL_HEADER.unpack(f.read(ZIP_LOCAL_HEADER.size))
+    if header[0] != b"PK\x03\x04":
+        raise ValueError("Stale EPUB index, no zip entry at the indexed offset")
+    nameLength, extraLength = header[-2], header[-1]
+    f.seek(nameLength + extraLength, os.SEEK_CUR)
+    data = f.read(member["compressedSize"])
+    if member["compression"] == 0:
+        return data
+    return zlib.decompress(data, -zlib.MAX_WBITS)
+
+
+def buildEpubIndex(path):
+    """
+    Indexes an EPUB once: its html chapters in the order send_next_chapter numbers them,
+    and for each chapter the zip location of its bytes and of the CSS and images it links.
+    """
+    import zipfile
+    import xml.etree.ElementTree as ElementTree
+
+    with zipfile.ZipFile(path) as book:
+        members = {info.filename: info for info in book.infolist()}
+        container = ElementTree.fromstring(book.read(CONTAINER_PATH))
+        opfPath = container.find(f"{CONTAINER_NAMESPACE}rootfiles/{CONTAINER_NAMESPACE}rootfile").get("full-path")
+        opfDir = posixpath.dirname(opfPath)
+        opf = ElementTree.fromstring(book.read(opfPath))
+
+        manifest = {}
+        for item in opf.find(f"{OPF_NAMESPACE}manifest"):
+            href = posixpath.normpath(posixpath.join(opfDir, item.get("href")))
+            if href in members:
+                manifest[href] = item.get("media-type")
+
+        def links(memberPath, pattern):
+            text = book.read(memberPath).decode("utf-8", "replace")
+            found = []
+            for link in pattern.findall(text):
+                target = posixpath.normpath(posixpath.join(posixpath.dirname(memberPath), link.strip()))
+                if target in manifest and target != memberPath and target not in found:
+                    found.append(target)
+            return found
+
+        assets = {}
+        chapters = []
+        # Same order as ebooklib's EpubHtml items, which the chapter numbers were based on
+        for href, mediaType in manifest.items():
+            if mediaType != "application/xhtml+xml":
+                continue
+            chapterAssets = []
+            for asset in links(href, LINK_PATTERN):
+                if manifest[asset] == "application/xhtml+xml":
+                    continue
+                chapterAssets.append(asset)
+                # Fonts and images a stylesheet pulls in
+                if manifest[asset] == "text/css":
+                    chapterAssets += [a for a in links(asset, CSS_URL_PATTERN) if a not in chapterAssets]
+            for asset in chapterAssets:
+                assets[asset] = {"mediaType": manifest[asset], **zipMemberInfo(members[asset])}
+            chapters.append({"href": href, "assets": chapterAssets, **zipMemberInfo(members[href])})
+
+    stat = os.stat(path)
+    return {
+        "version": EPUB_INDEX_VERSION,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "opfDir": opfDir,
+        "chapters": chapters,
+        "assets": assets,
+    }
+
+
+def loadEpubIndex(path):
+    """
+    Returns the index of an EPUB, cached in <file>.index.json and rebuilt when the file changes.
+    """
+    indexPath = path + ".index.json"
+    stat = os.stat(path)
+    try:
+        with open(indexPath, "r") as f:
+            index = json.load(f)
+        if (index.get("version"), index.get("size"), index.get("mtime")) == (EPUB_INDEX_VERSION, stat.st_size, stat.st_mtime):
+            return index
+    except (OSError, ValueError):
+        pass
+    index = buildEpubIndex(path)
+    try:
+        with open(indexPath + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(indexPath + ".tmp", indexPath)
+    except OSError as e:
+        print(f"Could not cache the index of {path}: {e}")
+    return index
+
 
 class Feeds:
-    def __init__(self):
-        convertors = []
+    def __init__(self, jobs=1):
+        # One log shared by every feed, loaded once per run
+        completionLog = openCompletionLog()
         with open(os.path.join(scriptPath, "feed.input.json"), "r") as f:
-            feeds = json.load(f)
+            feeds = [feed for feed in json.load(f) if not feed.get("ignore", False)]
+
+        def run(feed):
+            WebToEpub(feed, completionLog).convert()
+
+        if jobs <= 1:
             for feed in feeds:
-                if feed.get("ignore", False):
-                    # print(f"Ignoring {feed.get('name','')}")
-                    continue
-                convertor = WebToEpub(feed)
-                convertors.append(convertor)
-                convertor.convert()
+                run(feed)
+            return
+        # Feeds run in parallel, the chapters of one feed still go out in order
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for future in [executor.submit(run, feed) for feed in feeds]:
+                try:
+                    future.result()
+                except Exception as e:
+                    print("Exception ", str(e))
 
 
 class WebToEpub:
-    def __init__(self, feedObj):
-        self.completedUrls = []  # List of objects with `link` and `date`
-        self.scriptPath = "~"
-        self.getData()
+    def __init__(self, feedObj, completionLog):
+        self.completionLog = completionLog
+        self.scriptPath = scriptPath
         ssl._create_default_https_context = ssl._create_unverified_context
         self.feed = None
         self.file = None
         self.name = None
         if "url" in feedObj:
+            import feedparser
             self.feed = feedparser.parse(feedObj["url"])
 
         if "name" in feedObj:
@@ -61,63 +307,72 @@ class WebToEpub:
             self.file = feedObj["file"]
 
     def get_last_completed_timestamp(self):
-        if not self.completedUrls:
-            return None
-        last_completed = max(self.completedUrls, key=lambda x: x["date"])
-        return last_completed["date"]
+        return self.completionLog.lastDate
 
     def send_next_chapter(self):
         if not self.file:
             print("No file provided for this feed. Cannot send chapters.")
             return
 
-        # Find the last sent chapter from `completedObjects.db`
-        last_chapter = 0
-        for entry in self.completedUrls:
-            if entry["link"].startswith(f"chapter:{self.name}:"):
-                chapter_num = int(entry["link"].split(":")[-1])
-                last_chapter = max(last_chapter, chapter_num)
+        # Find the last sent chapter from the completion log
+        last_chapter = self.completionLog.lastChapters.get(self.name, 0)
 
         next_chapter = last_chapter + 1
 
-        # Read the EPUB file
-        book = epub.read_epub(self.file)
-        chapters = [item for item in book.items if isinstance(item, epub.EpubHtml)]
+        # Look the chapter up in the index instead of parsing the whole book
+        index = loadEpubIndex(self.file)
+        chapters = index["chapters"]
 
         if next_chapter > len(chapters):
             print(f"No more chapters to send for {self.name}.")
             return
 
-        # Extract the next chapter
-        chapter = chapters[next_chapter - 1]  # EPUB chapters are 0-indexed
+        chapter_entry = chapters[next_chapter - 1]  # EPUB chapters are 0-indexed
 
-        # Create a new EPUB with the single chapter
+        # Create a new EPUB with the single chapter and the stylesheets and images it uses
+        from ebooklib import epub
         new_book = epub.EpubBook()
         new_book.set_title(f"{self.name} - Chapter {next_chapter}")
         new_book.set_language("en")
         new_book.add_author("Unknown")
+        with open(self.file, "rb") as f:
+            chapter = epub.EpubHtml(
+                file_name=posixpath.relpath(chapter_entry["href"], index["opfDir"] or "."),
+                content=readZipMember(f, chapter_entry),
+            )
+            for href in chapter_entry["assets"]:
+                asset = index["assets"][href]
+                new_book.add_item(epub.EpubItem(
+                    file_name=posixpath.relpath(href, index["opfDir"] or "."),
+                    media_type=asset["mediaType"],
+                    content=readZipMember(f, asset),
+                ))
+            for href in chapter_entry["assets"]:
+                if index["assets"][href]["mediaType"] == "text/css":
+                    # ebooklib rebuilds the head, so stylesheets have to be linked again
+                    chapter.add_link(
+                        href=posixpath.relpath(href, posixpath.dirname(chapter_entry["href"])),
+                        rel="stylesheet",
+                        type="text/css",
+                    )
         new_book.add_item(chapter)
         new_book.spine = [chapter]
 
-        output_file = f"/tmp/{self.name.replace(' ', '_')}_Chapter_{next_chapter}.epub"
-        epub.write_epub(output_file, new_book)
+        workDir = tempfile.mkdtemp(prefix="webtoepub-")
+        try:
+            output_file = os.path.join(workDir, f"{self.name.replace(' ', '_')}_Chapter_{next_chapter}.epub")
+            epub.write_epub(output_file, new_book)
 
-        # Send the chapter using mutt
-        print(f"\nSending Chapter {next_chapter}: {self.name}")
-        subprocess.check_call(
-            f'echo book | mutt -s "{self.name} - Chapter {next_chapter}" -a "{output_file}" -- mnishamk95@kindle.com',
-            shell=True,
-            cwd=self.scriptPath,
-        )
+            # Send the chapter using mutt
+            print(f"\nSending Chapter {next_chapter}: {self.name}")
+            sendToKindle(f"{self.name} - Chapter {next_chapter}", output_file)
+        finally:
+            shutil.rmtree(workDir, ignore_errors=True)
 
-        # Add the sent chapter to `completedObjects.db`
-        self.completedUrls.append({
-            "link": f"chapter:{self.name}:{next_chapter}",
-            "date": int(time.time()),
-        })
-        self.saveData()
+        # Add the sent chapter to the completion log
+        self.completionLog.complete(f"chapter:{self.name}:{next_chapter}")
 
-        print(f"Chapter {next_chapter} sent and added to completedObjects.db.")
+        print(f"Chapter {next_chapter} sent and added to the completion log.")
 
     def convert(self):
         if self.file:
@@ -127,17 +382,18 @@ class WebToEpub:
         if not self.feed:
             return
         for entry in self.feed.entries[::-1]:
-            if not any(obj["link"] == entry.link for obj in self.completedUrls) and "Patron Early Access:" not in entry.title:
+            if not self.completionLog.contains(entry.link) and "Patron Early Access:" not in entry.title:
+                title = ((self.feed.feed.title + " - ") if self.feed.feed.title not in entry.title else "") + time.strftime("%Y-%m-%d", entry.published_parsed) + " - " + entry.title
                 try:
-                    self.epub(entry.link, ((self.feed.feed.title + " - ") if self.feed.feed.title not in entry.title else "") + time.strftime("%Y-%m-%d", entry.published_parsed) + " - " + entry.title)
+                    self.epub(entry.link, title, args.remove_images)
                 except:
                     try:
-                        args.remove_images = True
-                        self.epub(entry.link, ((self.feed.feed.title + " - ") if self.feed.feed.title not in entry.title else "") + time.strftime("%Y-%m-%d", entry.published_parsed) + " - " + entry.title)
+                        self.epub(entry.link, title, True)
                     except Exception as e:
                         print("Exception ", str(e))
 
-    def clean(self, url, html):
+    def clean(self, url, html, removeImages=False):
+        from bs4 import BeautifulSoup
         keywordsToRemove = KEYWORDS_TO_REMOVE
         cleanedHtml = html
         if "royalroad" in url:
@@ -171,7 +427,7 @@ class WebToEpub:
                 video.extract()
             for video in soup.find_all("span", {"class": "embed-youtube"}):
                 video.extract()
-            if args.remove_images:
+            if removeImages:
                 for img in soup.find_all("img"):
                     img.extract()
                 for img in soup.find_all("div", {"class": "gallery"}):
@@ -180,53 +436,48 @@ class WebToEpub:
 
         return cleanedHtml.html
 
-    def epub(self, url, title):
-        title = title.replace('"', '')
+    def epub(self, url, title, removeImages=False):
+        title = title.replace('"', '').replace('/', '-')
         print("Downloading: ", title)
+        from requests_html import HTMLSession
         session = HTMLSession()
         r = session.get(url)
-        htmlContent = self.clean(url, r.html)
-        with open("/tmp/article.html", "w") as file:
-            file.write(htmlContent)
-        subprocess.check_call('pandoc /tmp/article.html -o "output/' + title + '.epub" --metadata title="' + title + '" --metadata lang="en-US" --css epub.css', shell=True, cwd=self.scriptPath)
+        htmlContent = self.clean(url, r.html, removeImages)
+        outputFile = os.path.join("output", title + ".epub")
+        # Every job gets its own directory, so parallel conversions never share a file
+        workDir = tempfile.mkdtemp(prefix="webtoepub-")
+        try:
+            articlePath = os.path.join(workDir, "article.html")
+            with open(articlePath, "w") as file:
+                file.write(htmlContent)
+            subprocess.run(
+                ["pandoc", articlePath, "-o", outputFile, "--metadata", f"title={title}", "--metadata", "lang=en-US", "--css", "epub.css"],
+                check=True,
+                cwd=self.scriptPath,
+            )
+        finally:
+            shutil.rmtree(workDir, ignore_errors=True)
         if not args.dry_run:
             print("\nSending: ", title)
-            subprocess.check_call('echo book | mutt -s "' + title + '" -a "output/' + title + '.epub" -- mnishamk95@kindle.com', shell=True, cwd=self.scriptPath)
+            sendToKindle(title, outputFile)
         print("---")
         if not args.dry_run or args.update_db:
             self.complete(url)
 
     def complete(self, url):
-        current_epoch_time = int(time.time())
-        self.completedUrls.append({"link": url, "date": current_epoch_time})
-        self.saveData()
-
-    def saveData(self):
-        with open(os.path.join(self.scriptPath, "completedObjects.db"), "wb") as data:
-            pickle.dump(self.completedUrls, data)
-
-    def getData(self):
-        self.scriptPath = os.path.dirname(os.path.abspath(__file__))
-        try:
-            with open(os.path.join(self.scriptPath, "completedObjects.db"), "rb") as data:
-                self.completedUrls = pickle.load(data)
-        except Exception:
-            with open(os.path.join(self.scriptPath, "completedObjects.db"), "wb") as data:
-                pickle.dump(self.completedUrls, data)
+        self.completionLog.complete(url)
 
 def removeLink():
-    with open(os.path.join(scriptPath, "completedObjects.db"), "rb") as data:
-        completedUrls = pickle.load(data)
-    updatedUrls = [obj for obj in completedUrls if obj["link"] != args.link]
-    with open(os.path.join(scriptPath, "completedObjects.db"), "wb") as data:
-        pickle.dump(updatedUrls, data)
+    openCompletionLog().remove(args.link)
 
 def main():
     if args.link:
         if args.update_db:
             removeLink()
+    elif args.compact:
+        openCompletionLog()
     else:
-        Feeds()
+        Feeds(args.jobs)
 
 if __name__ == "__main__":
     main()